@@ -0,0 +1,63 @@
+import subprocess
+import sys
+from typing import List
+
+import pytest
+
+from sqlski import C, Relationship, func, select
+from tests.data.model import basket, customer, product, purchase
+
+
+@pytest.mark.benchmark(group="import")
+@pytest.mark.parametrize("module", ["sqlski", "tests.data.selects"])
+def test_import(benchmark, module):
+    # a fresh interpreter each round, so includes starting python
+    command = [sys.executable, "-c", f"import {module}"]
+    benchmark.pedantic(
+        subprocess.run, args=(command,), kwargs={"check": True}, rounds=5
+    )
+
+
+def declare():
+    # the classes of tests.data.selects, declared anew
+    @select
+    class Product:
+        product_id: int = C(product.c.product_id)
+        name: str = C(product.c.name)
+        price_cents: int = C(product.c.price_cents)
+
+    @select
+    class Purchase:
+        class Ignore:
+            purchase_id: int = C(purchase.c.purchase_id)
+            basket_id: int = C(purchase.c.basket_id)
+            product_id: int = C(purchase.c.product_id)
+
+        qty: int = C(purchase.c.qty)
+        qty_price_cents: int = C(qty * Product.price_cents)
+        product: Product = Relationship(Ignore.product_id == Product.product_id)
+
+    @select
+    class Basket:
+        class Ignore:
+            customer_id: int = C(basket.c.customer_id)
+
+        basket_id: int = C(basket.c.basket_id)
+        created_date: str = C(basket.c.created_date)
+        total_price_cents: int = C(func.sum(Purchase.qty_price_cents))
+        purchases: List[Purchase] = Relationship(basket_id == Purchase.Ignore.basket_id)
+
+    @select
+    class Customer:
+        customer_id: int = C(customer.c.customer_id)
+        aliased_username: str = C(customer.c.username)
+        upper_cased_username: str = C(func.upper(customer.c.username))
+        baskets: List[Basket] = Relationship(customer_id == Basket.Ignore.customer_id)
+
+    return Customer
+
+
+@pytest.mark.benchmark(group="declare")
+def test_declare(benchmark):
+    # the @select decorators of 4 classes, what a models module mostly costs
+    benchmark(declare)
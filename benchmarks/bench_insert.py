@@ -0,0 +1,91 @@
+from datetime import date
+
+import pytest
+
+from sqlski import C, do_inserts, insert
+from tests.data import inserts
+from tests.data.model import purchase
+
+from .conftest import SCALES
+
+METHODS = {
+    "values": {},
+    "unnest": {"unnest": True},
+    "single_statement": {"single_statement": True},
+}
+methods = pytest.mark.parametrize("method", METHODS.values(), ids=METHODS)
+
+
+@insert
+class FlatPurchase:
+    basket_id: int = C(purchase.c.basket_id)
+    product_id: int = C(purchase.c.product_id)
+    qty: int = C(purchase.c.qty)
+
+
+def customers(scale):
+    return [
+        inserts.Customer(
+            username=f"customer-{i}",
+            postcode="SL95GH",
+            dob=date(1990, 1, 1),
+            baskets=[
+                inserts.Basket(
+                    aliased_created_date=date(2020, 1, 1),
+                    purchases=[
+                        inserts.Purchase(product_id=1, qty=k + 1)
+                        for k in range(scale.purchases)
+                    ],
+                )
+                for _ in range(scale.baskets)
+            ],
+        )
+        for i in range(scale.customers)
+    ]
+
+
+def rolled_back(benchmark, conn, function, rounds=5):
+    # each round is inserted in a transaction that's rolled back before the
+    # next, so the tables stay the same size
+    transactions = []
+
+    def setup():
+        if transactions:
+            transactions.pop().rollback()
+        transactions.append(conn.begin())
+
+    try:
+        benchmark.pedantic(function, setup=setup, rounds=rounds)
+    finally:
+        if transactions:
+            transactions.pop().rollback()
+
+
+def throughput(benchmark, rows):
+    benchmark.extra_info["rows"] = rows
+    if benchmark.stats is not None:  # not with --benchmark-disable
+        median = benchmark.stats.stats.median
+        benchmark.extra_info["rows_per_sec"] = rows / median
+
+
+@pytest.mark.benchmark(group="do_inserts")
+@methods
+def test_do_inserts(benchmark, data, scale, method):
+    # the customer trees, rows counts all the layers
+    values = customers(SCALES[scale])
+    rolled_back(benchmark, data, lambda: do_inserts(data, values, **method))
+    scale = SCALES[scale]
+    rows = scale.customers * (1 + scale.baskets * (1 + scale.purchases))
+    throughput(benchmark, rows)
+
+
+@pytest.mark.benchmark(group="do_inserts_flat")
+@pytest.mark.parametrize(
+    "method", [*METHODS.values(), {"copy": True}], ids=[*METHODS, "copy"]
+)
+def test_do_inserts_flat(benchmark, data, scale, method):
+    # a layer without RETURNING, which COPY can insert
+    n = SCALES[scale].rows
+    values = [FlatPurchase(basket_id=1, product_id=1, qty=i) for i in range(n)]
+    rolled_back(benchmark, data, lambda: do_inserts(data, values, **method))
+    throughput(benchmark, n)
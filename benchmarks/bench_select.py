@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy.dialects.postgresql import psycopg2
+
+from sqlski import do_select, make_json_nested, make_nested, prepare_select, to_select
+from tests.data.selects import Basket, Customer, Product, Purchase
+
+from .conftest import SCALES
+
+dialect = psycopg2.dialect()
+NESTINGS = {"composite": make_nested, "json": make_json_nested}
+# by depth of nesting
+SELECTS = {
+    "product": Product,
+    "purchase": Purchase,
+    "basket": Basket,
+    "customer": Customer,
+}
+select_types = pytest.mark.parametrize("select_type", SELECTS.values(), ids=SELECTS)
+nestings = pytest.mark.parametrize("nesting", NESTINGS.values(), ids=NESTINGS)
+
+
+@pytest.mark.benchmark(group="to_select")
+@select_types
+def test_to_select(benchmark, select_type):
+    benchmark(
+        to_select,
+        select_type,
+        filters=[select_type.__sqlski_meta__.primary_key_columns[0] == 1],
+    )
+
+
+@pytest.mark.benchmark(group="compile")
+@select_types
+def test_compile(benchmark, select_type):
+    query = to_select(select_type).query
+    benchmark(query.compile, dialect=dialect)
+
+
+@pytest.mark.benchmark(group="do_select")
+@select_types
+@nestings
+def test_do_select(benchmark, data, scale, select_type, nesting):
+    def run():
+        return list(do_select(data, select_type, nesting=nesting))
+
+    instances = benchmark(run)
+    benchmark.extra_info["instances"] = len(instances)
+
+
+@pytest.mark.benchmark(group="do_select_one")
+@nestings
+@pytest.mark.parametrize("prepare", [False, True], ids=["text", "prepare"])
+def test_do_select_one(benchmark, data, scale, nesting, prepare):
+    # a lookup by primary key, so mostly the per call overhead, including
+    # Postgres parsing and planning the query unless it's PREPAREd
+    customer_id = SCALES[scale].customers // 2
+    filters = [Customer.customer_id == customer_id]
+    conn = data.execution_options(sqlski_prepare=prepare)
+
+    def run():
+        return list(do_select(conn, Customer, filters, nesting=nesting))
+
+    [customer] = benchmark(run)
+    assert customer.customer_id == customer_id
+
+
+@pytest.mark.benchmark(group="from_row")
+@select_types
+@nestings
+def test_from_row(benchmark, data, scale, select_type, nesting):
+    # only decoding the rows, psycopg2 has already cast them when fetching
+    prepared, params = prepare_select(select_type, nesting=nesting)
+    for register in prepared.registers:
+        register(data)
+    rows = prepared.execute(data, params).fetchall()
+    decoder = select_type.__sqlski_meta__.decoder
+
+    instances = benchmark(lambda: [decoder(row) for row in rows])
+    benchmark.extra_info["rows"] = len(instances)
+
+
+@pytest.mark.benchmark(group="do_select")
+@select_types
+def test_to_arrow(benchmark, data, scale, select_type):
+    # in the do_select group, to compare with its composite nesting
+    to_arrow = pytest.importorskip("sqlski.arrow").to_arrow
+    table = benchmark(to_arrow, data, select_type)
+    benchmark.extra_info["instances"] = table.num_rows
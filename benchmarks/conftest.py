@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+
+import pytest
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from tests.data.model import metadata
+
+
+@dataclass
+class Scale:
+    customers: int
+    baskets: int  # per customer
+    purchases: int  # per basket
+    products: int = 1000
+
+    @property
+    def rows(self) -> int:
+        return self.customers * self.baskets * self.purchases
+
+
+# by number of purchase rows, -wide has a larger fan-out to fewer parents
+SCALES = {
+    "1k": Scale(customers=40, baskets=5, purchases=5),
+    "1k-wide": Scale(customers=2, baskets=1, purchases=500),
+    "100k": Scale(customers=2000, baskets=5, purchases=10),
+    "1M": Scale(customers=10000, baskets=10, purchases=10),
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--scales",
+        default="1k,1k-wide",
+        help=f"comma separated scales of data to select, of {', '.join(SCALES)}",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        scales = metafunc.config.getoption("scales").split(",")
+        metafunc.parametrize("scale", scales, scope="session")
+
+
+@pytest.fixture(scope="session")
+def engine():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        metadata.create_all(engine)
+        with engine.connect() as conn:
+            conn.execute("CREATE INDEX ON basket (customer_id)")
+            conn.execute("CREATE INDEX ON purchase (basket_id)")
+        yield engine
+        engine.dispose()
+
+
+def generate(conn, scale: Scale) -> None:
+    # with SQL rather than do_inserts, which is benchmarked itself
+    with conn.begin():
+        conn.execute("TRUNCATE customer, product, basket, purchase RESTART IDENTITY")
+        conn.execute(
+            "INSERT INTO product (name, price_cents) "
+            "SELECT 'product-' || i, 100 + i %% 900 FROM generate_series(1, %s) i",
+            scale.products,
+        )
+        conn.execute(
+            "INSERT INTO customer (username, postcode, dob) "
+            "SELECT 'customer-' || i, 'SL95GH', date '1990-01-01' + i %% 10000 "
+            "FROM generate_series(1, %s) i",
+            scale.customers,
+        )
+        conn.execute(
+            "INSERT INTO basket (customer_id, created_date) "
+            "SELECT c, date '2020-01-01' + b FROM generate_series(1, %s) c, "
+            "generate_series(1, %s) b",
+            scale.customers,
+            scale.baskets,
+        )
+        conn.execute(
+            "INSERT INTO purchase (basket_id, product_id, qty) "
+            "SELECT b, (b * 7 + p) %% %s + 1, p FROM generate_series(1, %s) b, "
+            "generate_series(1, %s) p",
+            scale.products,
+            scale.customers * scale.baskets,
+            scale.purchases,
+        )
+    conn.execute("ANALYZE")
+
+
+@pytest.fixture(scope="session")
+def data(engine, scale):
+    # the connection, with the tables filled to the scale
+    conn = engine.connect()
+    generate(conn, SCALES[scale])
+    yield conn
+    conn.close()
@@ -0,0 +1,81 @@
+# Compare the composite type and json nesting strategies, run with:
+#
+#     python -m benchmarks.nesting [n_customers]
+import sys
+import time
+from datetime import date, timedelta
+
+import testing.postgresql
+from sqlalchemy import Text, create_engine
+from sqlalchemy.sql import cast
+from sqlalchemy.sql import func as sa_func
+from sqlalchemy.sql import select as sa_select
+
+from sqlski import do_inserts, do_select, make_json_nested, make_nested, prepare_select
+from tests.data import inserts, selects
+from tests.data.model import metadata
+
+STRATEGIES = {"composite": make_nested, "json": make_json_nested}
+
+
+def insert_data(conn, n_customers, n_baskets=5, n_purchases=5):
+    products = [
+        inserts.Product(name=f"product-{i}", price_cents=100 + i) for i in range(50)
+    ]
+    do_inserts(conn, products)
+    customers = [
+        inserts.Customer(
+            username=f"customer-{i}",
+            postcode="SL95GH",
+            dob=date(1990, 1, 1) + timedelta(days=i),
+            baskets=[
+                inserts.Basket(
+                    aliased_created_date=date(2020, 1, 1) + timedelta(days=j),
+                    purchases=[
+                        inserts.Purchase(product_id=(i + j + k) % 50 + 1, qty=k + 1)
+                        for k in range(n_purchases)
+                    ],
+                )
+                for j in range(n_baskets)
+            ],
+        )
+        for i in range(n_customers)
+    ]
+    do_inserts(conn, customers)
+
+
+def wire_bytes(conn, nesting):
+    prepared, params = prepare_select(selects.Customer, nesting=nesting)
+    for register in prepared.registers:
+        register(conn)
+    sub = prepared.query.alias()
+    sizes = [sa_func.sum(sa_func.octet_length(cast(c, Text))) for c in sub.c]
+    return sum(conn.execute(sa_select(sizes)).first())
+
+
+def timed(conn, nesting, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n = len(list(do_select(conn, selects.Customer, nesting=nesting)))
+        timings.append(time.perf_counter() - start)
+    return n, sorted(timings)[len(timings) // 2]
+
+
+def main(n_customers=1000, repeat=5):
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        metadata.create_all(engine)
+        conn = engine.connect()
+        insert_data(conn, n_customers)
+        print(f"{'strategy':<12}{'rows':>8}{'wire bytes':>14}{'median secs':>14}")
+        for name, nesting in STRATEGIES.items():
+            size = wire_bytes(conn, nesting)
+            n, seconds = timed(conn, nesting, repeat)
+            print(f"{name:<12}{n:>8}{size:>14}{seconds:>14.4f}")
+        conn.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+# Compare the GROUP BY and LATERAL strategies of joining relationships, run with:
+#
+#     python -m benchmarks.strategies [n_customers]
+import sys
+import time
+
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from sqlski import do_select
+from tests.data import selects
+from tests.data.model import metadata
+
+from .nesting import insert_data
+
+STRATEGIES = ["group_by", "lateral"]
+Customer = selects.Customer
+
+
+def queries(n_customers):
+    # name -> kwargs for do_select
+    return {
+        "all": {},
+        "one": {"filters": [Customer.customer_id == n_customers // 2]},
+        "page": {"order_by": [Customer.customer_id], "limit": 20},
+    }
+
+
+def timed(conn, strategy, kwargs, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n = len(list(do_select(conn, Customer, strategy=strategy, **kwargs)))
+        timings.append(time.perf_counter() - start)
+    return n, sorted(timings)[len(timings) // 2]
+
+
+def main(n_customers=1000, repeat=5):
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        metadata.create_all(engine)
+        conn = engine.connect()
+        # the foreign keys LATERAL looks up by, Postgres doesn't index these
+        conn.execute("CREATE INDEX ON basket (customer_id)")
+        conn.execute("CREATE INDEX ON purchase (basket_id)")
+        insert_data(conn, n_customers)
+        conn.execute("ANALYZE")
+        print(f"{'query':<8}{'strategy':<12}{'rows':>8}{'median secs':>14}")
+        for name, kwargs in queries(n_customers).items():
+            for strategy in STRATEGIES:
+                n, seconds = timed(conn, strategy, kwargs, repeat)
+                print(f"{name:<8}{strategy:<12}{n:>8}{seconds:>14.4f}")
+        conn.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
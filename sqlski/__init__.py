@@ -1,4 +1,38 @@
-from sqlski.helpers import sqlformat, sqlprint, sqlraw
+import importlib
+
+from sqlski.aio import async_do_inserts, async_do_select
+from sqlski.cache import Cache, MemoryCache, invalidate_tables
+from sqlski.events import PhaseEvent, Timings, add_listener, remove_listener
 from sqlski.insert import do_inserts, to_inserts
-from sqlski.select import do_select, from_row, to_select
-from sqlski.types import C, InsertUsing, Relationship, func, insert, select
+from sqlski.select import (
+    do_select,
+    from_row,
+    install_types,
+    make_installed_nested,
+    make_json_nested,
+    make_nested,
+    prepare_select,
+    to_select,
+)
+from sqlski.types import (
+    UNLOADED,
+    C,
+    InsertUsing,
+    Relationship,
+    func,
+    insert,
+    select,
+)
+
+# sqlski.helpers imports sqlparse, which is only needed to print queries
+_LAZY = {
+    "sqlformat": "sqlski.helpers",
+    "sqlprint": "sqlski.helpers",
+    "sqlraw": "sqlski.helpers",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_LAZY[name]), name)
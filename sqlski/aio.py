@@ -0,0 +1,327 @@
+# asyncio versions of do_select/do_inserts for asyncpg connections.
+#
+# SQLAlchemy (1.3) is only used to build and compile the queries, these are
+# then run with asyncpg, which decodes composite types and arrays natively so
+# they don't need registering like with psycopg2.
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+from weakref import WeakKeyDictionary, ref
+
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.types import TypeDecorator, TypeEngine
+
+from .cache import Cache, invalidate_tables
+from .composite import CompositeArray, CompositeType, references
+from .events import _phase
+from .insert import _chunks, _written_tables, to_inserts
+from .jsonagg import JsonType
+from .select import (
+    GROUP_BY,
+    CreateType,
+    OrderBy,
+    SelectOptions,
+    _cache_set,
+    _cached,
+    _decode_all,
+    _decoder,
+    _key_position,
+    _options,
+    _pending_parents,
+    _prepare_select,
+    _project,
+    _selectin_query,
+    _selectin_selects,
+    _stitch,
+    make_nested,
+)
+from .statements import dialect
+from .types import Insert, Nesting, Operation, PreparedSelect, Projection, R
+
+Processor = Optional[Callable[[Any], Any]]
+
+
+# asyncpg connection -> {type name: signature}, only for types created
+# outside of a transaction, temporary types outlive the pool's RESET ALL
+_registered: "WeakKeyDictionary[Any, Dict[str, Hashable]]" = WeakKeyDictionary()
+_compiled: "WeakKeyDictionary[PreparedSelect, Compiled]" = WeakKeyDictionary()
+# asyncpg connection -> the tables written in its transaction and the query
+# logger invalidating them once it's over
+_written: "WeakKeyDictionary[Any, Tuple[Set[str], Callable]]" = WeakKeyDictionary()
+
+
+@dataclass
+class Compiled:
+    compiled: SQLCompiler
+    process_row: Processor
+
+    def args(self, params: Optional[Dict[str, Any]] = None) -> List[Any]:
+        values = self.compiled.construct_params(params)
+        processors = self.compiled._bind_processors
+        return [
+            processors[name](values[name]) if name in processors else values[name]
+            for name in self.compiled.positiontup
+        ]
+
+    def process(self, rows: Iterable[Any]) -> Iterable[Any]:
+        if self.process_row is None:
+            return rows
+        return map(self.process_row, rows)
+
+
+def _result_processor(type_: TypeEngine) -> Processor:
+    # asyncpg already decodes the builtin types, composites and arrays
+    if isinstance(type_, (CompositeType, CompositeArray, JsonType, TypeDecorator)):
+        return type_._cached_result_processor(dialect, None)
+    return None
+
+
+def _compile(query: ClauseElement) -> Compiled:
+    compiled = query.compile(dialect=dialect)
+    processors = [_result_processor(c[3]) for c in compiled._result_columns]
+    if not any(processors):
+        return Compiled(compiled, None)
+
+    def process_row(row: Any) -> Any:
+        return tuple(v if p is None else p(v) for v, p in zip(row, processors))
+
+    return Compiled(compiled, process_row)
+
+
+def _database(conn: Any) -> str:
+    # for the cache keys, as the URL of the engines
+    underlying = getattr(conn, "_con", conn)
+    params = underlying._params
+    return f"postgresql://{params.user}@{underlying._addr}/{params.database}"
+
+
+def _invalidate_on_commit(conn: Any, tables: Iterable[str]) -> None:
+    # as cache._invalidate_on_commit, asyncpg has no events for the end of a
+    # transaction, but its query loggers are called after the COMMIT/ROLLBACK
+    underlying = getattr(conn, "_con", conn)
+    if not underlying.is_in_transaction():
+        invalidate_tables(tables)
+        return
+    if underlying not in _written:
+        reference = ref(underlying)
+
+        def on_query(record: Any) -> None:
+            written = reference()
+            if written is None or written.is_in_transaction():
+                return
+            written_tables, logger = _written.pop(written, (set(), None))
+            if logger is not None:
+                written.remove_query_logger(logger)
+            invalidate_tables(written_tables)
+
+        _written[underlying] = (set(), on_query)
+        underlying.add_query_logger(on_query)
+    _written[underlying][0].update(tables)
+
+
+async def _register(conn: Any, prepared: PreparedSelect) -> None:
+    # PoolConnectionProxy can't be weakly referenced, use its connection
+    underlying = getattr(conn, "_con", conn)
+    registered = _registered.setdefault(underlying, {})
+    created = False
+    for type_ in prepared.nested_types:
+        # installed types exist already, see select.install_types
+        if not isinstance(type_, CompositeType) or type_.schema is not None:
+            continue
+        if registered.get(type_.name) == type_.signature:
+            continue
+        # DROP TYPE ... CASCADE takes out the attributes of the types using it
+        for name, signature in list(registered.items()):
+            if references(signature, type_.name):
+                del registered[name]
+        ddl = CreateType(type_.name, type_.columns)
+        await conn.execute(str(ddl.compile(dialect=dialect)))
+        if not conn.is_in_transaction():
+            registered[type_.name] = type_.signature
+        created = True
+    if created:
+        # forget any codecs/statements asyncpg cached for previous versions
+        await conn.reload_schema_state()
+
+
+def _compiled_for(prepared: PreparedSelect) -> Compiled:
+    compiled = _compiled.get(prepared)
+    if compiled is None:
+        with _phase("compile", prepared.select_type):
+            compiled = _compiled[prepared] = _compile(prepared.query)
+    return compiled
+
+
+async def _fetch(conn: Any, prepared: PreparedSelect, params: Dict[str, Any]):
+    await _register(conn, prepared)
+    compiled = _compiled_for(prepared)
+    with _phase("execute", prepared.select_type) as event:
+        rows = await conn.fetch(compiled.compiled.string, *compiled.args(params))
+        if event is not None:
+            event.rows = len(rows)
+    return list(compiled.process(rows))
+
+
+async def _load_selectins(
+    conn: Any,
+    select_type: Type[R],
+    instances: List[R],
+    options: SelectOptions,
+    identities: Optional[Dict[Hashable, Any]],
+    projection: Optional[Projection],
+) -> None:
+    # as select._load_selectins
+    for relationship, parents in _pending_parents(select_type, instances):
+        query = _selectin_query(relationship, parents, options, projection)
+        children = []
+        if query is not None:
+            position = _key_position(relationship, projection)
+            decoder = _decoder(relationship.type, identities, True, projection)
+            rows = await _fetch(conn, *query)
+            _, instances = _decode_all(
+                relationship.type, decoder, lambda: rows, relationship
+            )
+            children = [(row[position], i) for row, i in zip(rows, instances)]
+            await _load_selectins(
+                conn, relationship.type, instances, options, identities, projection
+            )
+        _stitch(relationship, parents, children)
+
+
+async def async_do_select(
+    conn: Any,
+    select_type: Type[R],
+    filters: Optional[List[Operation]] = None,
+    stream: bool = False,
+    batch_size: int = 1000,
+    nesting: Nesting = make_nested,
+    order_by: Optional[OrderBy] = None,
+    limit: Optional[int] = None,
+    after: Optional[List[Any]] = None,
+    strategy: str = GROUP_BY,
+    identity_map: bool = False,
+    cache: Optional[Cache] = None,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+) -> AsyncIterator[R]:
+    options = _options(
+        filters, nesting, order_by, limit, after, strategy, fields, exclude
+    )
+    if cache is not None and not stream:
+        database = _database(conn)
+        key, cached = _cached(cache, database, select_type, options, identity_map)
+        if key is not None:
+            if cached is None:
+                selected = _async_do_select(
+                    conn, select_type, options, False, 0, identity_map
+                )
+                cached = [instance async for instance in selected]
+                _cache_set(cache, key, select_type, cached)
+            for instance in cached:
+                yield instance
+            return
+    selected = _async_do_select(
+        conn, select_type, options, stream, batch_size, identity_map
+    )
+    async for instance in selected:
+        yield instance
+
+
+async def _async_do_select(
+    conn: Any,
+    select_type: Type[R],
+    options: SelectOptions,
+    stream: bool,
+    batch_size: int,
+    identity_map: bool,
+) -> AsyncIterator[R]:
+    projection = _project(select_type, options)
+    prepared, params = _prepare_select(select_type, options, projection)
+    identities: Optional[Dict[Hashable, Any]] = {} if identity_map else None
+    decoder = _decoder(select_type, identities, projection=projection)
+
+    async def load(instances: List[R]) -> None:
+        await _load_selectins(
+            conn, select_type, instances, options, identities, projection
+        )
+
+    if not stream:
+        rows = await _fetch(conn, prepared, params)
+        _, instances = _decode_all(select_type, decoder, lambda: rows)
+        await load(instances)
+        for instance in instances:
+            yield instance
+        return
+
+    # before the transaction, so the types are remembered for every batch
+    await _register(conn, prepared)
+    for selectin in _selectin_selects(select_type, options, projection):
+        await _register(conn, selectin)
+    compiled = _compiled_for(prepared)
+    sql, args = compiled.compiled.string, compiled.args(params)
+    # asyncpg cursors have to be in a transaction
+    transaction = None if conn.is_in_transaction() else conn.transaction()
+    if transaction is not None:
+        await transaction.start()
+    try:
+        batch = []
+        async for row in conn.cursor(sql, *args, prefetch=batch_size):
+            if compiled.process_row is not None:
+                row = compiled.process_row(row)
+            batch.append(decoder(row))
+            if len(batch) == batch_size:
+                await load(batch)
+                for instance in batch:
+                    yield instance
+                batch = []
+        await load(batch)
+        for instance in batch:
+            yield instance
+    except BaseException:
+        # including the GeneratorExit of a caller that stops early
+        if transaction is not None:
+            await transaction.rollback()
+        raise
+    if transaction is not None:
+        await transaction.commit()
+
+
+async def async_do_inserts(
+    conn: Any,
+    inserts: Union[Iterable[Insert], Insert],
+    single_statement: bool = False,
+    unnest: bool = False,
+    chunk_size: Optional[int] = None,
+    returning: bool = True,
+) -> List[Any]:
+    if hasattr(inserts, "__sqlski_meta__"):
+        inserts = [inserts]
+    returned: List[Any] = []
+    for chunk in _chunks(inserts, chunk_size):
+        querys = to_inserts(chunk, single_statement=single_statement, unnest=unnest)
+        for i, query in enumerate(querys):
+            compiled = _compile(query.query)
+            # as insert.Query.__call__
+            with _phase("insert", query.insert_type) as event:
+                if event is not None:
+                    event.rows = query.rows
+                rows = await conn.fetch(compiled.compiled.string, *compiled.args())
+                rows = list(compiled.process(rows))
+            query._add_children(rows)
+            if i == 0 and returning and chunk[0].__sqlski_meta__.returning_selects:
+                returned.extend(rows)
+        _invalidate_on_commit(conn, _written_tables(chunk[0]))
+    return returned
@@ -0,0 +1,146 @@
+# Columnar output of selects as pyarrow Tables, for analytical consumers that
+# would otherwise rebuild do_select's instances into pandas/Arrow.
+#
+# The rows are transposed into a column per field and handed to pyarrow as
+# is, nested relationships become list<struct> (or struct) columns built from
+# the flattened children, so no instances are made. pyarrow is optional, it's
+# only imported by this module.
+from dataclasses import fields as dataclass_fields
+from datetime import date, datetime, time
+from itertools import accumulate, chain
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+import pyarrow as pa
+from sqlalchemy.engine import Connection
+
+from .events import _phase
+from .select import GROUP_BY, OrderBy, make_nested, prepare_select
+from .types import (
+    SELECTIN,
+    Nesting,
+    Operation,
+    Projection,
+    R,
+    RelationshipBundle,
+    projection_names,
+    row_positions,
+)
+
+# python field type -> arrow type, the others are inferred from the values
+ARROW_TYPES: Dict[Any, pa.DataType] = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    date: pa.date32(),
+    datetime: pa.timestamp("us"),
+    time: pa.time64("us"),
+}
+
+
+def _arrow_type(type_: Any) -> Optional[pa.DataType]:
+    # Optional[int] -> int
+    if getattr(type_, "__origin__", None) is Union:
+        args = [a for a in type_.__args__ if a is not type(None)]
+        if len(args) == 1:
+            type_ = args[0]
+    return ARROW_TYPES.get(type_)
+
+
+def _width(select_type: Type[R], projection: Optional[Projection]) -> int:
+    # the number of columns of its rows
+    return len(row_positions(select_type, projection))
+
+
+def _arrays(
+    select_type: Type[R], columns: List[Sequence[Any]], projection: Optional[Projection]
+) -> Tuple[List[pa.Array], List[str]]:
+    meta = select_type.__sqlski_meta__
+    loaded = projection_names(select_type, projection)
+    positions = row_positions(select_type, projection)
+    relationships = {r.name: r for r in meta.relationships}
+
+    arrays, names = [], []
+    for field in dataclass_fields(select_type):
+        if field.name not in loaded:
+            continue
+        relationship = relationships.get(field.name)
+        if relationship is not None and relationship.strategy == SELECTIN:
+            raise RuntimeError(
+                f"to_arrow can't load the selectin relationship "
+                f"{select_type.__name__}.{field.name}, exclude= it"
+            )
+        values = columns[positions[field.name]]
+        if relationship is None:
+            array = pa.array(values, type=_arrow_type(field.type))
+        else:
+            array = _nested_array(relationship, values, projection)
+        arrays.append(array)
+        names.append(field.name)
+    return arrays, names
+
+
+def _struct_array(
+    select_type: Type[R], rows: Sequence[Any], projection: Optional[Projection]
+) -> pa.StructArray:
+    mask = None
+    if any(row is None for row in rows):
+        mask = pa.array([row is None for row in rows])
+        empty = (None,) * _width(select_type, projection)
+        rows = [empty if row is None else row for row in rows]
+    columns = list(zip(*rows)) or [()] * _width(select_type, projection)
+    arrays, names = _arrays(select_type, columns, projection)
+    return pa.StructArray.from_arrays(arrays, names, mask=mask)
+
+
+def _nested_array(
+    relationship: RelationshipBundle,
+    values: Sequence[Any],
+    projection: Optional[Projection],
+) -> pa.Array:
+    if not relationship.is_many:
+        return _struct_array(relationship.type, values, projection)
+    values = [value or [] for value in values]
+    offsets = pa.array([0, *accumulate(map(len, values))], type=pa.int32())
+    children = list(chain.from_iterable(values))
+    struct = _struct_array(relationship.type, children, projection)
+    return pa.ListArray.from_arrays(offsets, struct)
+
+
+def to_arrow(
+    conn: Connection,
+    select_type: Type[R],
+    filters: Optional[List[Operation]] = None,
+    nesting: Nesting = make_nested,
+    order_by: Optional[OrderBy] = None,
+    limit: Optional[int] = None,
+    after: Optional[List[Any]] = None,
+    strategy: str = GROUP_BY,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+) -> pa.Table:
+    # the same rows as do_select, as a Table with a column per field, use
+    # .to_pandas()/.column(name).to_numpy() for pandas/NumPy
+    prepared, params = prepare_select(
+        select_type,
+        filters=filters,
+        nesting=nesting,
+        order_by=order_by,
+        limit=limit,
+        after=after,
+        strategy=strategy,
+        fields=fields,
+        exclude=exclude,
+    )
+    for register in prepared.registers:
+        register(conn)
+    projection = prepared.projection
+    rows = prepared.execute(conn, params)
+    with _phase("decode", select_type) as event:
+        rows = rows.fetchall()
+        columns = list(zip(*rows)) or [()] * _width(select_type, projection)
+        arrays, names = _arrays(select_type, columns, projection)
+        if event is not None:
+            event.rows = len(rows)
+    return pa.Table.from_arrays(arrays, names=names)
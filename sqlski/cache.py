@@ -0,0 +1,140 @@
+# Caching of do_select results, see do_select(..., cache=...).
+#
+# Entries are the lists of instances of a select, keyed on a string of the
+# select class, the filter/page shape and the parameters (select._cache_key),
+# and tagged with the names of the tables the select reads. do_inserts
+# invalidates the tables it writes to in every cache a select used, once its
+# transaction is over.
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from weakref import WeakSet
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import Pool
+
+# the tables written in the current transaction, stored on the pooled DBAPI
+# connection's info dict like the registered composite types
+_WRITTEN_KEY = "sqlski_written_tables"
+
+
+class Cache:
+    # the interface for cache backends, eg. for a cache shared between
+    # processes, the keys are strings and the values lists of instances
+    def get(self, key: str) -> Optional[List[Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: List[Any], tables: FrozenSet[str]) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, tables: Iterable[str]) -> None:
+        # forget the entries of selects reading any of the tables
+        raise NotImplementedError
+
+
+@dataclass(eq=False)
+class MemoryCache(Cache):
+    # least recently used entries are evicted past max_size, entries older
+    # than ttl seconds are never returned
+    max_size: int = 1024
+    ttl: Optional[float] = None
+    # key -> (expires, value, tables)
+    _entries: "OrderedDict[str, Tuple[float, List[Any], FrozenSet[str]]]" = field(
+        default_factory=OrderedDict
+    )
+    _keys_by_table: Dict[str, Set[str]] = field(
+        default_factory=lambda: defaultdict(set)
+    )
+    _lock: Lock = field(default_factory=Lock)
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, _ = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: List[Any], tables: FrozenSet[str]) -> None:
+        expires = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires, value, tables)
+            for table in tables:
+                self._keys_by_table[table].add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tables: Iterable[str]) -> None:
+        with self._lock:
+            for table in tables:
+                for key in list(self._keys_by_table.get(table, ())):
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_table.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for table in entry[2]:
+            keys = self._keys_by_table[table]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_table[table]
+
+
+# the caches passed to do_select, so do_inserts can invalidate them
+_caches: "WeakSet[Cache]" = WeakSet()
+
+
+def _remember(cache: Cache) -> None:
+    _caches.add(cache)
+
+
+def invalidate_tables(tables: Iterable[str]) -> None:
+    # for writes not made with do_inserts
+    tables = frozenset(tables)
+    for cache in list(_caches):
+        cache.invalidate(tables)
+
+
+def _invalidate_on_commit(conn: Connection, tables: Iterable[str]) -> None:
+    # until the transaction commits, other connections' selects would cache
+    # the rows from before the writes again
+    if not conn.in_transaction():
+        # autocommitted already
+        invalidate_tables(tables)
+        return
+    conn.connection.info.setdefault(_WRITTEN_KEY, set()).update(tables)
+
+
+def _invalidate_written(info: Dict) -> None:
+    # on rollback too, selects in the transaction may have cached its writes
+    invalidate_tables(info.pop(_WRITTEN_KEY, ()))
+
+
+@event.listens_for(Engine, "commit")
+def _on_commit(conn):
+    # just before the COMMIT, there's no event after it
+    _invalidate_written(conn.connection.info)
+
+
+@event.listens_for(Engine, "rollback")
+def _on_rollback(conn):
+    _invalidate_written(conn.connection.info)
+
+
+@event.listens_for(Pool, "reset")
+def _on_reset(dbapi_connection, connection_record):
+    _invalidate_written(connection_record.info)
@@ -1,12 +1,35 @@
 # Lovingly stolen from https://sqlalchemy-utils.readthedocs.io/en/latest/_modules/sqlalchemy_utils/types/pg_composite.html
+import hashlib
 from collections import namedtuple
+from threading import Lock
+from typing import TYPE_CHECKING, Dict, Hashable, Optional, Tuple
 
-from psycopg2.extensions import register_type
-from psycopg2.extras import CompositeCaster
+from psycopg2.extensions import new_array_type, new_type, register_type
+from sqlalchemy import event
 from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import Pool
 from sqlalchemy.sql import text
 from sqlalchemy.types import SchemaType, TypeDecorator, UserDefinedType
 
+from .events import _count_bytes
+
+if TYPE_CHECKING:
+    from psycopg2.extras import CompositeCaster
+
+# name -> (signature, durable), stored on the pooled DBAPI connection's info
+# dict, which SQLAlchemy clears itself when the connection is recycled
+RegisteredComposites = Dict[str, Tuple[Hashable, bool]]
+_REGISTERED_KEY = "sqlski_registered_composites"
+# type name -> the number of times it's been created on the connection, and
+# the server-side prepared statements (see statements.py) with the numbers of
+# the types they were prepared with
+_CREATED_KEY = "sqlski_created_composites"
+_STATEMENTS_KEY = "sqlski_prepared_statements"
+
+# the schema of the types created by select.install_types
+INSTALLED_SCHEMA = "sqlski"
+
 
 class CompositeArray(ARRAY):
     def _proc_array(self, arr, itemproc, dim, collection):
@@ -16,23 +39,34 @@ class CompositeArray(ARRAY):
                 return arr
         return ARRAY._proc_array(self, arr, itemproc, dim, collection)
 
+    def result_processor(self, dialect, coltype):
+        item_type = self.item_type.dialect_impl(dialect)
+        if item_type.result_processor(dialect, coltype) is None:
+            # psycopg2 has already cast the array and its items
+            return None
+        return super().result_processor(dialect, coltype)
+
 
 class CompositeType(UserDefinedType, SchemaType):
     python_type = tuple
 
-    def __init__(self, name, columns):
-        SchemaType.__init__(self)
+    def __init__(self, name, columns, schema=None, label=None):
+        SchemaType.__init__(self, schema=schema)
         self.name = name
         self.columns = columns
+        # the relationship nested, for events.PhaseEvent.relationship_bytes
+        self.label = label or name
         self.type_cls = namedtuple(self.name, [c.name for c in columns])
-
-        class Caster(CompositeCaster):
-            def make(obj, values):
-                return self.type_cls(*values)
-
-        self.caster = Caster
+        # includes the signatures of nested composites, so that a parent type
+        # is recreated whenever one of its children is
+        self.signature = (
+            name,
+            tuple((c.name, _type_signature(c.type)) for c in columns),
+        )
 
     def get_col_spec(self):
+        if self.schema is not None:
+            return f"{self.schema}.{self.name}"
         return self.name
 
     def bind_processor(self, dialect):
@@ -57,32 +91,54 @@ class CompositeType(UserDefinedType, SchemaType):
         return process
 
     def result_processor(self, dialect, coltype):
+        decorated = [
+            (i, column.type)
+            for i, column in enumerate(self.columns)
+            if isinstance(column.type, TypeDecorator)
+        ]
+        if not decorated:
+            # psycopg2's caster has already made a type_cls
+            return None
+
         def process(value):
             if value is None:
                 return None
-            cls = value.__class__
-            kwargs = {}
-            for column in self.columns:
-                if isinstance(column.type, TypeDecorator):
-                    kwargs[column.name] = column.type.process_result_value(
-                        getattr(value, column.name), dialect
-                    )
-                else:
-                    kwargs[column.name] = getattr(value, column.name)
-            return cls(**kwargs)
+            values = list(value)
+            for i, type_ in decorated:
+                values[i] = type_.process_result_value(values[i], dialect)
+            return self.type_cls(*values)
 
         return process
 
 
+def _type_signature(type_) -> Hashable:
+    if isinstance(type_, CompositeType):
+        return type_.signature
+    if isinstance(type_, ARRAY):
+        return ("ARRAY", _type_signature(type_.item_type))
+    return str(type_)
+
+
+def installed_name(label: str, columns) -> str:
+    # named by a hash of the attributes (including those of nested types), so
+    # a changed select gets a new type and the old one stays valid for
+    # processes still running the old code, Postgres names are <= 63 bytes
+    signature = tuple((c.name, _type_signature(c.type)) for c in columns)
+    digest = hashlib.sha1(repr(signature).encode()).hexdigest()[:12]
+    return f"_type_{label[:40]}_{digest}"
+
+
 def from_db(conn, tname):
+    # psycopg2.extras is imported as needed, it's slow to import
+    from psycopg2.extras import CompositeCaster
+
     qry = text(
         f"""
         SELECT t.oid, typarray, attname, atttypid
         FROM pg_type t
-        JOIN pg_namespace ns ON typnamespace = ns.oid
         JOIN pg_attribute a ON attrelid = typrelid
         WHERE typname = :tname
-            AND nspname LIKE 'pg_temp%'
+            AND typnamespace = pg_my_temp_schema()
             AND attnum > 0
             AND NOT attisdropped
         ORDER BY attnum;
@@ -102,7 +158,153 @@ def from_db(conn, tname):
     return CompositeCaster(tname, type_oid, type_attrs, array_oid=array_oid)
 
 
+# (database url, schema) -> {type name: caster}, the oids of installed types
+# don't change, so the catalog is read once per process rather than once per
+# connection
+_installed: Dict[Tuple[str, str], Dict[str, "CompositeCaster"]] = {}
+_installed_lock = Lock()
+
+
+def installed_from_db(conn, schema) -> Dict[str, "CompositeCaster"]:
+    from psycopg2.extras import CompositeCaster
+
+    qry = text(
+        """
+        SELECT typname, t.oid, typarray, attname, atttypid
+        FROM pg_type t
+        JOIN pg_namespace n ON n.oid = typnamespace
+        JOIN pg_attribute a ON attrelid = typrelid
+        WHERE nspname = :schema
+            AND typtype = 'c'
+            AND attnum > 0
+            AND NOT attisdropped
+        ORDER BY typname, attnum;
+    """
+    )
+    attrs: Dict[str, list] = {}
+    oids: Dict[str, Tuple[int, int]] = {}
+    for tname, type_oid, array_oid, attname, atttypid in conn.execute(
+        qry, schema=schema
+    ):
+        oids[tname] = (type_oid, array_oid)
+        attrs.setdefault(tname, []).append((attname, atttypid))
+    return {
+        tname: CompositeCaster(
+            tname, oids[tname][0], type_attrs, array_oid=oids[tname][1]
+        )
+        for tname, type_attrs in attrs.items()
+    }
+
+
+def forget_installed() -> None:
+    # call this if the installed types are dropped and installed again
+    with _installed_lock:
+        _installed.clear()
+
+
+def _installed_caster(conn, composite) -> "CompositeCaster":
+    key = (str(conn.engine.url), composite.schema)
+    with _installed_lock:
+        casters = _installed.get(key)
+        if casters is None or composite.name not in casters:
+            casters = _installed[key] = installed_from_db(conn, composite.schema)
+    if composite.name not in casters:
+        raise RuntimeError(
+            f"type {composite.schema}.{composite.name} isn't installed, "
+            "see install_types"
+        )
+    return casters[composite.name]
+
+
 def register_psycopg2_composite(conn, composite):
-    caster = from_db(conn, composite.name)
-    register_type(caster.typecaster, conn.connection.connection)
-    register_type(caster.array_typecaster, conn.connection.connection)
+    if composite.schema is not None:
+        caster = _installed_caster(conn, composite)
+    else:
+        caster = from_db(conn, composite.name)
+
+    def cast(value, cursor):
+        # counts the bytes parsed for events.PhaseEvent.relationship_bytes
+        _count_bytes(composite.label, value)
+        return caster.parse(value, cursor)
+
+    typecaster = new_type((caster.oid,), caster.name, cast)
+    array_typecaster = new_array_type(
+        (caster.array_oid,), f"{caster.name}ARRAY", typecaster
+    )
+    register_type(typecaster, conn.connection.connection)
+    register_type(array_typecaster, conn.connection.connection)
+
+
+def _registered_composites(conn: Connection) -> RegisteredComposites:
+    return conn.connection.info.setdefault(_REGISTERED_KEY, {})
+
+
+def is_registered(conn: Connection, composite: CompositeType) -> bool:
+    registered = _registered_composites(conn).get(composite.name)
+    return registered is not None and registered[0] == composite.signature
+
+
+def references(signature: Hashable, name: str) -> bool:
+    # whether the composite with this signature has an attribute of type name
+    _, columns = signature
+    for _, type_signature in columns:
+        if isinstance(type_signature, tuple) and type_signature[0] == "ARRAY":
+            type_signature = type_signature[1]
+        if isinstance(type_signature, tuple) and (
+            type_signature[0] == name or references(type_signature, name)
+        ):
+            return True
+    return False
+
+
+def mark_registered(
+    conn: Connection, composite: CompositeType, durable: Optional[bool] = None
+) -> None:
+    registered = _registered_composites(conn)
+    # DROP TYPE ... CASCADE takes out the attributes of the types using it
+    for name, (signature, _) in list(registered.items()):
+        if references(signature, composite.name):
+            del registered[name]
+    # DDL outside of a transaction is autocommitted, otherwise it only
+    # survives if the transaction does
+    if durable is None:
+        durable = not conn.in_transaction()
+    registered[composite.name] = (composite.signature, durable)
+    created = conn.connection.info.setdefault(_CREATED_KEY, {})
+    created[composite.name] = created.get(composite.name, 0) + 1
+
+
+# call this after anything that drops temporary types or prepared statements,
+# eg. DISCARD ALL
+def clear_registered_composites(conn: Connection) -> None:
+    conn.connection.info.pop(_REGISTERED_KEY, None)
+    conn.connection.info.pop(_STATEMENTS_KEY, None)
+
+
+def _forget_uncommitted(info: Dict) -> None:
+    registered = info.get(_REGISTERED_KEY, {})
+    for name, (signature, durable) in list(registered.items()):
+        if not durable:
+            del registered[name]
+
+
+@event.listens_for(Engine, "commit")
+def _on_commit(conn):
+    registered = conn.connection.info.get(_REGISTERED_KEY, {})
+    for name, (signature, _) in registered.items():
+        registered[name] = (signature, True)
+
+
+@event.listens_for(Engine, "rollback")
+def _on_rollback(conn):
+    _forget_uncommitted(conn.connection.info)
+
+
+@event.listens_for(Engine, "rollback_savepoint")
+def _on_rollback_savepoint(conn, name, context):
+    _forget_uncommitted(conn.connection.info)
+
+
+@event.listens_for(Pool, "reset")
+def _on_reset(dbapi_connection, connection_record):
+    _forget_uncommitted(connection_record.info)
@@ -0,0 +1,142 @@
+# Timing of the phases of do_select/do_inserts, for metrics and tracing.
+#
+# Listeners added with add_listener are called with a PhaseEvent at the end
+# of each phase, in the thread that ran it:
+#
+#   build        to_select building the SQLAlchemy query (on a prepare_select
+#                cache miss)
+#   create_type  CREATE TYPE of a composite type
+#   catalog      looking up a created type's attributes in pg_type
+#   compile      compiling a prepared query (once per dialect)
+#   prepare      PREPARE of a query on a connection (with the sqlski_prepare
+#                execution option, see statements.py)
+#   execute      running the query, including transferring the rows unless
+#                streaming
+#   decode       fetching and decoding the rows into instances, with the
+#                instances and bytes of each nested relationship
+#   cache        looking up do_select(..., cache=...) results
+#   insert       each layer query of do_inserts
+#
+# With no listeners the phases aren't timed and cost next to nothing.
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+@dataclass
+class PhaseEvent:
+    phase: str
+    # the select/insert class, if the phase is for one
+    type: Any = None
+    # perf_counter() at the start and the duration of the phase
+    start: float = 0.0
+    seconds: float = 0.0
+    # the number of rows returned/inserted/decoded
+    rows: Optional[int] = None
+    # for decode, relationship name -> the number of nested instances and the
+    # bytes of composite type text parsed (including any nested within it,
+    # only known for make_nested)
+    relationship_rows: Dict[str, int] = field(default_factory=dict)
+    relationship_bytes: Dict[str, int] = field(default_factory=dict)
+    details: Dict[str, Any] = field(default_factory=dict)
+
+
+Listener = Callable[[PhaseEvent], None]
+_listeners: List[Listener] = []
+_local = threading.local()
+
+
+def add_listener(listener: Listener) -> None:
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Listener) -> None:
+    _listeners.remove(listener)
+
+
+def timed() -> bool:
+    return bool(_listeners)
+
+
+@contextmanager
+def _phase(phase: str, type_: Any = None) -> Iterator[Optional[PhaseEvent]]:
+    # yields None when there are no listeners, otherwise an event that the
+    # phase can add rows/details to
+    if not _listeners:
+        yield None
+        return
+    event = PhaseEvent(phase, type_, start=perf_counter())
+    previous = getattr(_local, "bytes", None)
+    if phase == "decode":
+        _local.bytes = Counter()
+    try:
+        yield event
+    finally:
+        event.seconds = perf_counter() - event.start
+        if phase == "decode":
+            event.relationship_bytes.update(_local.bytes)
+            _local.bytes = previous
+        for listener in list(_listeners):
+            listener(event)
+
+
+def _count_bytes(label: str, value: Optional[str]) -> None:
+    # called by the composite typecasters, see composite.register_psycopg2_composite
+    counts = getattr(_local, "bytes", None)
+    if counts is not None and value is not None:
+        counts[label] += len(value)
+
+
+@dataclass
+class PhaseTotal:
+    count: int = 0
+    seconds: float = 0.0
+    rows: int = 0
+
+
+@dataclass(eq=False)
+class Timings:
+    # a listener totalling the events by phase (and type), use as
+    #
+    #   with Timings() as timings:
+    #       do_select(conn, Customer)
+    #   print(timings.report())
+    #
+    # listeners see the events of every thread
+    phases: Dict[str, PhaseTotal] = field(default_factory=dict)
+    types: Dict[Any, Dict[str, PhaseTotal]] = field(default_factory=dict)
+    relationship_rows: Counter = field(default_factory=Counter)
+    relationship_bytes: Counter = field(default_factory=Counter)
+
+    def __call__(self, event: PhaseEvent) -> None:
+        by_type = self.types.setdefault(event.type, {})
+        for totals in [self.phases, by_type]:
+            total = totals.setdefault(event.phase, PhaseTotal())
+            total.count += 1
+            total.seconds += event.seconds
+            total.rows += event.rows or 0
+        self.relationship_rows.update(event.relationship_rows)
+        self.relationship_bytes.update(event.relationship_bytes)
+
+    def __enter__(self) -> "Timings":
+        add_listener(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        remove_listener(self)
+
+    def report(self) -> str:
+        lines = [f"{'phase':<14}{'count':>8}{'rows':>10}{'secs':>12}"]
+        for phase, total in self.phases.items():
+            lines.append(
+                f"{phase:<14}{total.count:>8}{total.rows:>10}{total.seconds:>12.6f}"
+            )
+        if self.relationship_rows:
+            lines.append(f"{'relationship':<14}{'':>8}{'rows':>10}{'bytes':>12}")
+        for name, rows in self.relationship_rows.items():
+            n_bytes = self.relationship_bytes.get(name, "")
+            lines.append(f"{name:<14}{'':>8}{rows:>10}{n_bytes:>12}")
+        return "\n".join(lines)
@@ -36,6 +36,10 @@ class LiteralCompiler(psycopg2.PGCompiler_psycopg2):
             return repr(value)
         elif isinstance(value, (date, datetime)):
             return f"'{value.isoformat()}'"
+        elif isinstance(value, (list, tuple)):
+            item_type = getattr(type_, "item_type", type_)
+            items = [self.render_literal_value(v, item_type) for v in value]
+            return f"ARRAY[{', '.join(items)}]"
         else:
             return "42"
             breakpoint()
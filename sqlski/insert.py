@@ -1,28 +1,256 @@
+import io
 from dataclasses import dataclass
-from typing import Any, Callable, Iterator, List, Union
+from datetime import date, datetime, time
+from itertools import count, islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+from sqlalchemy import BigInteger, Column, Table
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.dialects.postgresql import insert as sa_insert
 from sqlalchemy.engine import Connection
-from sqlalchemy.sql import ClauseElement, literal, select
+from sqlalchemy.sql import (
+    ClauseElement,
+    TableClause,
+    bindparam,
+    column,
+    literal,
+    select,
+    table,
+    text,
+)
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.types import TypeEngine
 
+from .cache import _invalidate_on_commit
+from .events import _phase
 from .types import Insert
 
+pg_dialect = postgresql.psycopg2.dialect()
+
+
+def _add_nothing(returnings: List[Any]) -> None:
+    pass
+
 
 @dataclass
 class Query:
     query: ClauseElement
     _query_function: Callable[[Connection], List[Any]]
+    # called with the RETURNING rows, adds the queries for the child inserts
+    _add_children: Callable[[List[Any]], None] = _add_nothing
+    # the insert class and number of rows of the layer, for events
+    insert_type: Any = None
+    rows: Optional[int] = None
 
     def __call__(self, conn: Connection):
-        return self._query_function(conn)
+        with _phase("insert", self.insert_type) as event:
+            if event is not None:
+                event.rows = self.rows
+            return self._query_function(conn)
 
 
 null_select = select([literal(None)]).where(literal(False))
 
 
-def to_inserts(inserts: Union[List[Insert], Insert]) -> Iterator[Query]:
+def _unnest(
+    name: str, columns: Sequence[Tuple[str, TypeEngine, List[Any]]]
+) -> Tuple[str, List[BindParameter]]:
+    # one array parameter per column, so the SQL doesn't depend on the number
+    # of rows, WITH ORDINALITY numbers the rows from 1 as _ord
+    params = [
+        bindparam(f"{name}_{column_name}", value=values, type_=ARRAY(type_))
+        for column_name, type_, values in columns
+    ]
+    arrays = ", ".join(
+        f"CAST(:{param.key} AS {pg_dialect.type_compiler.process(type_)}[])"
+        for param, (_, type_, _) in zip(params, columns)
+    )
+    names = ", ".join(pg_dialect.identifier_preparer.quote(c) for c, _, _ in columns)
+    sql = f"SELECT * FROM unnest({arrays}) WITH ORDINALITY AS _v({names}, _ord)"
+    return sql, params
+
+
+def _to_single_insert(inserts: List[Insert]) -> Query:
+    # chains data-modifying CTEs, each layer joins on the row numbers of its
+    # parent layer's RETURNING to get the values for InsertUsing
+    ctes: List[str] = []
+    params: List[BindParameter] = []
+    layer_numbers = count()
+
+    def add_ctes(
+        inserts: List[Insert],
+        parent_ords: List[int],
+        parent: Optional[TableClause],
+        using: List[Column],
+    ) -> Optional[TableClause]:
+        first = inserts[0]
+        fields = first.__sqlski_meta__.column_fields
+        table_ = first.__sqlski_meta__.table
+        returning = first.__sqlski_meta__.returning_selects
+        relationships = first.__sqlski_meta__.relationships
+        if relationships and not returning:
+            raise RuntimeError(
+                f"{type(first)} has child inserts, but no RETURNING values"
+            )
+        n = next(layer_numbers)
+        values_name = f"_values_{n}"
+        insert_name = f"_insert_{n}"
+        returned_name = f"_returned_{n}"
+
+        columns = [
+            (field.default.column.name, field.default.column.type, [])
+            for field in fields
+        ]
+        for i in inserts:
+            for field, (_, _, values) in zip(fields, columns):
+                values.append(getattr(i, field.name))
+        if parent is not None:
+            columns.insert(0, ("_parent_ord", BigInteger(), parent_ords))
+        sql, values_params = _unnest(values_name, columns)
+        ctes.append(f"{values_name} AS ({sql})")
+        params.extend(values_params)
+
+        values_columns = [column(c) for c, _, _ in columns] + [column("_ord")]
+        values = table(values_name, *values_columns)
+        selects = [values.c[field.default.column.name] for field in fields]
+        names = [field.default.column.name for field in fields]
+        from_ = values
+        if parent is not None:
+            selects = [parent.c[c.name] for c in using] + selects
+            names = [c.name for c in using] + names
+            from_ = values.join(parent, parent.c._ord == values.c._parent_ord)
+        query = select(selects).select_from(from_).order_by(values.c._ord)
+        query = sa_insert(table_).from_select(names, query)
+        if returning:
+            query = query.returning(*returning)
+        ctes.append(f"{insert_name} AS ({query.compile(dialect=pg_dialect)})")
+        if not returning:
+            return None
+
+        ctes.append(
+            f"{returned_name} AS "
+            f"(SELECT *, row_number() OVER () AS _ord FROM {insert_name})"
+        )
+        returned_columns = [column(r.name) for r in returning] + [column("_ord")]
+        returned = table(returned_name, *returned_columns)
+        for relationship in relationships:
+            child_inserts, child_parent_ords = [], []
+            for ord_, i in enumerate(inserts, start=1):
+                for child_insert in getattr(i, relationship.name):
+                    child_inserts.append(child_insert)
+                    child_parent_ords.append(ord_)
+            if child_inserts:
+                using = [c.column for c in relationship.using]
+                add_ctes(child_inserts, child_parent_ords, returned, using)
+        return returned
+
+    returned = add_ctes(inserts, [], None, [])
+    returning = inserts[0].__sqlski_meta__.returning_selects
+    if returned is None:
+        final, result_columns = "SELECT NULL WHERE false", []
+    else:
+        quote = pg_dialect.identifier_preparer.quote
+        names = ", ".join(quote(r.name) for r in returning)
+        final = f"SELECT {names} FROM {returned.name} ORDER BY _ord"
+        result_columns = [column(r.name, r.type) for r in returning]
+    sql = "WITH " + ",\n".join(ctes) + "\n" + final
+    query = text(sql).bindparams(*params).columns(*result_columns)
+    # SQLAlchemy only autocommits text starting with INSERT etc.
+    query = query.execution_options(autocommit=True)
+
+    def f(conn: Connection):
+        if returned is None:
+            return conn.execute(query)
+        return [r for r in conn.execute(query)]
+
+    return Query(query, f, insert_type=type(inserts[0]), rows=len(inserts))
+
+
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+
+def _copy_value(value: Any, processor: Optional[Callable[[Any], Any]]) -> str:
+    # the value as the INSERT path would bind it, eg. Enum members by name and
+    # JSON serialized, then as in "Text Format" of
+    # https://www.postgresql.org/docs/current/sql-copy.html
+    if processor is not None:
+        value = processor(value)
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, (dict, list, tuple)):
+        raise RuntimeError(f"Don't know how to COPY value {value}, use copy=False")
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _to_copy(table: Table, values: List[Dict[str, Any]], insert_type: Any) -> Query:
+    # for layers without RETURNING, COPY doesn't need compiling and has no
+    # limit on the number of parameters
+    names = list(values[0])
+    processors = [
+        table.c[name].type.dialect_impl(pg_dialect).bind_processor(pg_dialect)
+        for name in names
+    ]
+    quote = pg_dialect.identifier_preparer.quote
+    columns = ", ".join(quote(name) for name in names)
+    table_name = pg_dialect.identifier_preparer.format_table(table)
+    query = text(f"COPY {table_name} ({columns}) FROM STDIN")
+
+    def f(conn: Connection):
+        stream = io.StringIO()
+        for value in values:
+            row = (_copy_value(value[n], p) for n, p in zip(names, processors))
+            stream.write("\t".join(row) + "\n")
+        stream.seek(0)
+        with conn.begin():
+            cursor = conn.connection.cursor()
+            cursor.copy_expert(str(query), stream)
+        return []
+
+    return Query(query, f, insert_type=insert_type, rows=len(values))
+
+
+def _to_unnest_insert(table: Table, values: List[Dict[str, Any]]) -> ClauseElement:
+    # the SQL is the same whatever the number of rows
+    names = list(values[0])
+    columns = [(n, table.c[n].type, [value[n] for value in values]) for n in names]
+    sql, params = _unnest("_values", columns)
+    unnested = text(sql).bindparams(*params)
+    unnested = unnested.columns(*[column(n) for n in names + ["_ord"]])
+    unnested = unnested.alias("_values")
+    query = select([unnested.c[n] for n in names]).order_by(unnested.c._ord)
+    return sa_insert(table).from_select(names, query)
+
+
+def to_inserts(
+    inserts: Union[List[Insert], Insert],
+    single_statement: bool = False,
+    copy: bool = False,
+    unnest: bool = False,
+) -> Iterator[Query]:
     if not isinstance(inserts, list):
         inserts = [inserts]
+    if single_statement:
+        if copy:
+            raise RuntimeError("can't COPY as part of a single statement")
+        return iter([_to_single_insert(inserts)] if inserts else [])
 
     querys: List[Query] = []
 
@@ -41,19 +269,23 @@ def to_inserts(inserts: Union[List[Insert], Insert]) -> Iterator[Query]:
         for value, parent_returning in zip(values, parent_returnings):
             value.update(dict(parent_returning))
 
-        query = sa_insert(table).values(values)
+        if copy and not returning and not relationships:
+            querys.append(_to_copy(table, values, type(first)))
+            return
+
+        if unnest:
+            query = _to_unnest_insert(table, values)
+        else:
+            query = sa_insert(table).values(values)
         if returning:
             query = query.returning(*returning)
 
-        def f(conn: Connection):
-            if not returning:
-                if relationships:
-                    raise RuntimeError(
-                        f"{type(first)} has child inserts, but no RETURNING values"
-                    )
-                return conn.execute(query)
+        if relationships and not returning:
+            raise RuntimeError(
+                f"{type(first)} has child inserts, but no RETURNING values"
+            )
 
-            returnings = [r for r in conn.execute(query)]
+        def add_children(returnings: List[Any]) -> None:
             for relationship in relationships:
                 insert_using_column_names = [c.column.name for c in relationship.using]
                 parent_returnings = [
@@ -73,9 +305,14 @@ def to_inserts(inserts: Union[List[Insert], Insert]) -> Iterator[Query]:
                 child_inserts, parent_returnings_flat = zip(*all_child_inserts_flat)
                 add_query(child_inserts, parent_returnings_flat)
 
+        def f(conn: Connection):
+            if not returning:
+                return conn.execute(query)
+            returnings = [r for r in conn.execute(query)]
+            add_children(returnings)
             return returnings
 
-        querys.append(Query(query, f))
+        querys.append(Query(query, f, add_children, type(first), len(values)))
 
     def iter_querys():
         while querys:
@@ -85,11 +322,48 @@ def to_inserts(inserts: Union[List[Insert], Insert]) -> Iterator[Query]:
     return iter_querys()
 
 
-def do_inserts(conn: Connection, inserts: Union[List[Insert], Insert]) -> List[Any]:
-    if not isinstance(inserts, list):
+def _chunks(
+    inserts: Iterable[Insert], chunk_size: Optional[int]
+) -> Iterator[List[Insert]]:
+    iterator = iter(inserts)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+        if chunk_size is None:
+            return
+
+
+def _written_tables(insert: Insert) -> List[str]:
+    return [
+        d.__sqlski_meta__.table.fullname for d in insert.__sqlski_meta__.descendants
+    ]
+
+
+def do_inserts(
+    conn: Connection,
+    inserts: Union[Iterable[Insert], Insert],
+    single_statement: bool = False,
+    copy: bool = False,
+    unnest: bool = False,
+    chunk_size: Optional[int] = None,
+    returning: bool = True,
+) -> List[Any]:
+    # with a chunk_size, inserts can be a generator, all the layers are
+    # inserted for each chunk before the next chunk is read, returning=False
+    # doesn't keep the top level RETURNING rows of every chunk
+    if hasattr(inserts, "__sqlski_meta__"):
         inserts = [inserts]
-    querys = to_inserts(inserts)
-    returning = next(querys)(conn)
-    for query in querys:
-        query(conn)
-    return returning
+    returned: List[Any] = []
+    for chunk in _chunks(inserts, chunk_size):
+        querys = to_inserts(
+            chunk, single_statement=single_statement, copy=copy, unnest=unnest
+        )
+        rows = next(querys)(conn)
+        for query in querys:
+            query(conn)
+        _invalidate_on_commit(conn, _written_tables(chunk[0]))
+        if returning and chunk[0].__sqlski_meta__.returning_selects:
+            returned.extend(rows)
+    return returned
@@ -0,0 +1,113 @@
+import json
+import re
+from collections import namedtuple
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.sql import cast, type_coerce
+from sqlalchemy.types import (
+    Date,
+    DateTime,
+    Numeric,
+    Text,
+    Time,
+    TypeDecorator,
+    UserDefinedType,
+)
+
+Converter = Callable[[Any], Any]
+
+# Postgres trims trailing zeros from fractional seconds, which python<3.11's
+# fromisoformat doesn't understand
+_FRACTION = re.compile(r"\.(\d{1,5})(?=[+-]|$)")
+
+
+def _pad_fraction(value: str) -> str:
+    return _FRACTION.sub(lambda m: "." + m.group(1).ljust(6, "0"), value)
+
+
+def _to_datetime(value: str) -> datetime:
+    return datetime.fromisoformat(_pad_fraction(value))
+
+
+def _to_time(value: str) -> time:
+    return time.fromisoformat(_pad_fraction(value))
+
+
+def _to_converter(type_: Any) -> Optional[Converter]:
+    if isinstance(type_, JsonType):
+        return type_.decode
+    if isinstance(type_, TypeDecorator):
+        impl_converter = _to_converter(type_.impl)
+        if impl_converter is None:
+            return lambda v: type_.process_result_value(v, None)
+        return lambda v: type_.process_result_value(impl_converter(v), None)
+    if isinstance(type_, ARRAY):
+        item_converter = _to_converter(type_.item_type)
+        if item_converter is None:
+            return None
+        return lambda v: [None if i is None else item_converter(i) for i in v]
+    if isinstance(type_, DateTime):
+        return _to_datetime
+    if isinstance(type_, Date):
+        return date.fromisoformat
+    if isinstance(type_, Time):
+        return _to_time
+    # includes Float, which defaults to asdecimal=False
+    if isinstance(type_, Numeric):
+        return Decimal if type_.asdecimal else float
+    if isinstance(type_, PG_UUID) and type_.as_uuid:
+        return UUID
+    return None
+
+
+class JsonType(UserDefinedType):
+    python_type = tuple
+
+    def __init__(self, name, columns, many=False):
+        self.name = name
+        self.columns = columns
+        self.many = many
+        self.type_cls = namedtuple(self.name, [c.name for c in columns])
+        self.converters = [(c.name, _to_converter(c.type)) for c in columns]
+
+    def get_col_spec(self):
+        return "JSON"
+
+    def column_expression(self, colexpr):
+        # only applied to the outermost SELECT, nested values stay as JSON
+        # and are decoded in one go by result_processor
+        return type_coerce(cast(colexpr, Text), self)
+
+    def _decode_one(self, obj: dict) -> Any:
+        return self.type_cls(
+            *[
+                (
+                    obj[name]
+                    if converter is None or obj[name] is None
+                    else converter(obj[name])
+                )
+                for name, converter in self.converters
+            ]
+        )
+
+    def decode(self, value: Any) -> Any:
+        if value is None:
+            return None
+        if self.many:
+            return [self._decode_one(obj) for obj in value]
+        return self._decode_one(value)
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            if isinstance(value, str):
+                value = json.loads(value, parse_float=Decimal)
+            return self.decode(value)
+
+        return process
@@ -1,37 +1,92 @@
 from collections import defaultdict
-from dataclasses import dataclass, fields
-from typing import Any, Dict, Iterator, List, Optional, Type, Union
+from copy import deepcopy
+from dataclasses import dataclass, field, replace
+from dataclasses import fields as dataclass_fields
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from sqlalchemy import Column, Table
-from sqlalchemy.dialects.postgresql import base
-from sqlalchemy.engine import Connection
+from sqlalchemy.dialects.postgresql import aggregate_order_by, base
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.schema import CreateColumn
 from sqlalchemy.sql import Alias, ClauseElement
 from sqlalchemy.sql import and_ as sa_and
-from sqlalchemy.sql import case, cast
+from sqlalchemy.sql import any_, bindparam, case, cast
 from sqlalchemy.sql import func as sa_func
+from sqlalchemy.sql import literal_column
+from sqlalchemy.sql import or_ as sa_or
 from sqlalchemy.sql import select as sa_select
+from sqlalchemy.sql import text, true
 from sqlalchemy.sql.ddl import DDLElement
+from sqlalchemy.sql.elements import FunctionFilter, Over, WithinGroup
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.sql.visitors import iterate
 
-from .composite import CompositeArray, CompositeType, register_psycopg2_composite
+from .cache import Cache, _remember
+from .composite import (
+    INSTALLED_SCHEMA,
+    CompositeArray,
+    CompositeType,
+    forget_installed,
+    installed_name,
+    is_registered,
+    mark_registered,
+    register_psycopg2_composite,
+)
+from .events import PhaseEvent, _phase, timed
+from .jsonagg import JsonType
 from .types import (
+    GROUP_BY,
+    LATERAL,
+    SELECTIN,
     BinOperation,
     C,
     Func,
     Nested,
+    Nesting,
     Operation,
+    Pending,
+    PreparedSelect,
+    Projection,
     QueryBundle,
     R,
     RegisterSqlType,
-    Relationship,
+    RelationshipBundle,
     Select,
     TypeToSubqueryMap,
-    to_is_many_and_type,
+    UnaryOperation,
+    Unloaded,
+    decoders,
+    projection_key,
+    projection_names,
 )
 
+OrderBy = List[Union[C, Column, Operation]]
+
+# how relationships are nested, see get_select and get_lateral_select
+STRATEGIES = (GROUP_BY, LATERAL)
+
 
 def visit_create_temp_type(self, create):
     cols = ",\n".join(self.process(CreateColumn(col)) for col in create.columns)
+    if create.schema is not None:
+        # installed types are named by their attributes, so never replaced
+        return f"CREATE TYPE {create.schema}.{create.name} AS ({cols})"
     return f"""
         DROP TYPE IF EXISTS pg_temp.{create.name} CASCADE;
         CREATE TYPE pg_temp.{create.name} AS ({cols});
@@ -47,28 +102,57 @@ class CreateType(DDLElement):
     __visit_name__ = "create_temp_type"
     name: str
     columns: List[ClauseElement]
+    schema: Optional[str] = None
 
 
 def make_nested(
     columns: Union[List[Column], Table, Alias],
     label: str,
     many: bool = False,
+    order_by: Optional[List[ClauseElement]] = None,
+) -> Nested:
+    return _make_composite_nested(columns, label, many, order_by, None)
+
+
+def make_installed_nested(
+    columns: Union[List[Column], Table, Alias],
+    label: str,
+    many: bool = False,
+    order_by: Optional[List[ClauseElement]] = None,
+) -> Nested:
+    # nests with the types created by install_types, so runs no DDL, and only
+    # reads the catalog once per process
+    return _make_composite_nested(columns, label, many, order_by, INSTALLED_SCHEMA)
+
+
+def _make_composite_nested(
+    columns: Union[List[Column], Table, Alias],
+    label: str,
+    many: bool,
+    order_by: Optional[List[ClauseElement]],
+    schema: Optional[str],
 ) -> Nested:
     if isinstance(columns, (Table, Alias)):
         columns = list(columns.c)
     if len(columns) == 0:
         raise RuntimeError("Cannot handle edge case of zero columns")
 
-    name = f"_type_{label}"
     column_types = [Column(col.name, col.type) for col in columns]
+    if schema is None:
+        name = f"_type_{label}"
+    else:
+        name = installed_name(label, column_types)
 
-    sqlalchemy_type = CompositeType(name, column_types)
+    sqlalchemy_type = CompositeType(name, column_types, schema=schema, label=label)
     sqlalchemy_array_type = CompositeArray(sqlalchemy_type)
 
     expression = cast(sa_func.row(*columns), type_=sqlalchemy_type)
     if many:
+        if order_by:
+            expression = aggregate_order_by(expression, *order_by)
         expression = sa_func.array_agg(expression, type_=sqlalchemy_array_type)
-        expression = case([(sa_func.count(columns[0]) == 0, "{}")], else_=expression)
+        empty = literal_column("'{}'")
+        expression = case([(sa_func.count(columns[0]) == 0, empty)], else_=expression)
         expression = expression.label(label)
         expression.type = sqlalchemy_array_type
     else:
@@ -76,8 +160,16 @@ def make_nested(
         expression.type = sqlalchemy_type
 
     def register(conn: Connection) -> ClauseElement:
-        conn.execute(CreateType(name, column_types))
-        register_psycopg2_composite(conn, sqlalchemy_type)
+        if is_registered(conn, sqlalchemy_type):
+            return
+        if schema is None:
+            with _phase("create_type"):
+                conn.execute(CreateType(name, column_types))
+        with _phase("catalog"):
+            register_psycopg2_composite(conn, sqlalchemy_type)
+        # installed types outlive any transaction
+        durable = True if schema is not None else None
+        mark_registered(conn, sqlalchemy_type, durable)
 
     return Nested(
         sqlalchemy_type=sqlalchemy_type,
@@ -86,45 +178,401 @@ def make_nested(
     )
 
 
+def _register_nothing(conn: Connection) -> None:
+    pass
+
+
+def make_json_nested(
+    columns: Union[List[Column], Table, Alias],
+    label: str,
+    many: bool = False,
+    order_by: Optional[List[ClauseElement]] = None,
+) -> Nested:
+    # nests with json_build_object/json_agg, so doesn't need any DDL
+    if isinstance(columns, (Table, Alias)):
+        columns = list(columns.c)
+    if len(columns) == 0:
+        raise RuntimeError("Cannot handle edge case of zero columns")
+
+    column_types = [Column(col.name, col.type) for col in columns]
+    sqlalchemy_type = JsonType(f"_type_{label}", column_types, many=many)
+
+    keys_and_values = []
+    for col in columns:
+        key = col.name.replace("'", "''")
+        keys_and_values.extend([literal_column(f"'{key}'"), col])
+    expression = sa_func.json_build_object(*keys_and_values)
+    if many:
+        if order_by:
+            expression = aggregate_order_by(expression, *order_by)
+        expression = sa_func.json_agg(expression)
+        empty = literal_column("'[]'")
+        expression = case([(sa_func.count(columns[0]) == 0, empty)], else_=expression)
+    expression = expression.label(label)
+    expression.type = sqlalchemy_type
+
+    return Nested(
+        sqlalchemy_type=sqlalchemy_type,
+        expression=expression,
+        register=_register_nothing,
+    )
+
+
 def _resolve_column(scope: TypeToSubqueryMap, value: Any) -> ClauseElement:
+    if isinstance(value, Operation):
+        return _resolve_operation(scope, value)
     if not isinstance(value, C):
         return value
     return scope[value.select_type].c[value.name]
 
 
-def _resolve_operation(scope: TypeToSubqueryMap, operation: Operation) -> str:
-    # This should work recursively and it doesn't
+def _apply_operation(operation: Operation, args: List[Any]) -> ClauseElement:
+    if isinstance(operation, BinOperation) and operation.attr == "in_":
+        # one array parameter, rather than one per value
+        return args[0] == any_(args[1])
     if isinstance(operation, BinOperation):
-        left = _resolve_column(scope, operation.left)
-        right = _resolve_column(scope, operation.right)
-        return getattr(left, operation.attr)(right)
+        return getattr(args[0], operation.attr)(args[1])
     if isinstance(operation, Func):
-        args = [_resolve_column(scope, arg) for arg in operation.args]
         return getattr(sa_func, operation.attr)(*args)
+    if isinstance(operation, UnaryOperation):
+        return getattr(args[0], operation.attr)()
     raise RuntimeError(f"don't yet support operation type: {operation}")
 
 
+def _resolve_operation(scope: TypeToSubqueryMap, operation: Operation) -> str:
+    args = [_resolve_column(scope, arg) for arg in _operation_args(operation)]
+    return _apply_operation(operation, args)
+
+
+def _resolve_order_by(
+    sub: Alias, select_type: Type[Select], order_by: OrderBy
+) -> List[ClauseElement]:
+    scope = {select_type: sub}
+    resolved = []
+    for value in order_by:
+        if isinstance(value, Operation):
+            resolved.append(_resolve_operation(scope, value))
+        elif isinstance(value, C):
+            resolved.append(_resolve_column(scope, value))
+        else:
+            column = sub.corresponding_column(value)
+            if column is None:
+                raise RuntimeError(f"can't order {select_type} by {value}")
+            resolved.append(column)
+    return resolved
+
+
+class _NeedsRelationship(Exception):
+    pass
+
+
+# Postgres refuses aggregates (and window functions) in a WHERE
+_AGGREGATES = frozenset(
+    [
+        "array_agg",
+        "avg",
+        "bit_and",
+        "bit_or",
+        "bool_and",
+        "bool_or",
+        "count",
+        "every",
+        "json_agg",
+        "json_object_agg",
+        "jsonb_agg",
+        "jsonb_object_agg",
+        "max",
+        "min",
+        "mode",
+        "percentile_cont",
+        "percentile_disc",
+        "stddev",
+        "stddev_pop",
+        "stddev_samp",
+        "string_agg",
+        "sum",
+        "var_pop",
+        "var_samp",
+        "variance",
+        "xmlagg",
+    ]
+)
+
+
+def _has_aggregate(value: ClauseElement) -> bool:
+    return any(
+        isinstance(e, (Over, WithinGroup, FunctionFilter))
+        or (isinstance(e, FunctionElement) and e.name.lower() in _AGGREGATES)
+        for e in iterate(value, {})
+    )
+
+
+def _table_expression(select_type: Type[Select], value: Any) -> Any:
+    # value in terms of just select_type's table, raises _NeedsRelationship
+    # if it refers to the subquery of a relationship, or aggregates, which
+    # need its GROUP BY
+    if isinstance(value, C):
+        if value.select_type is not select_type:
+            raise _NeedsRelationship
+        return _table_expression(select_type, value.column)
+    if isinstance(value, Operation):
+        args = [_table_expression(select_type, arg) for arg in _operation_args(value)]
+        value = _apply_operation(value, args)
+    if isinstance(value, ClauseElement):
+        table = select_type.__sqlski_meta__.table
+        if any(t is not table for t in find_tables(value)) or _has_aggregate(value):
+            raise _NeedsRelationship
+    return value
+
+
+def _push_down(
+    select_type: Type[Select], operations: List[Operation]
+) -> Tuple[List[ClauseElement], List[Operation]]:
+    # splits the filters into those on just the table, that can be applied
+    # before the GROUP BY, and those that need the relationships
+    pushed, kept = [], []
+    for operation in operations:
+        try:
+            pushed.append(_table_expression(select_type, operation))
+        except _NeedsRelationship:
+            kept.append(operation)
+    return pushed, kept
+
+
+def _children(select_type: Type[Select]) -> Dict[str, RelationshipBundle]:
+    return {r.name: r for r in select_type.__sqlski_meta__.relationships}
+
+
+def _resolve_path(
+    select_type: Type[Select], path: str
+) -> Tuple[List[Tuple[Type[Select], str]], Optional[RelationshipBundle]]:
+    # "baskets.purchases.qty" -> the (type, name) of each step, and the
+    # relationship of the last step, if it is one
+    steps = []
+    relationship = None
+    for name in path.split("."):
+        if relationship is not None:
+            select_type = relationship.type
+        names = {f.name for f in dataclass_fields(select_type)}
+        if name not in names:
+            raise RuntimeError(f"{select_type} has no field {name}, in {path}")
+        steps.append((select_type, name))
+        relationship = _children(select_type).get(name)
+    return steps, relationship
+
+
+def _column_args(value: Any) -> Iterator[C]:
+    if isinstance(value, C):
+        yield value
+        if isinstance(value.column, Operation):
+            yield from _column_args(value.column)
+    elif isinstance(value, Operation):
+        for arg in _operation_args(value):
+            yield from _column_args(arg)
+
+
+def _project(select_type: Type[R], options: "SelectOptions") -> Optional[Projection]:
+    # the fields and relationships to load for fields=/exclude=, dotted paths
+    # like "baskets.basket_id", a relationship on its own is all of it, plus
+    # whatever is needed to join, filter, order and compute those
+    fields, exclude = options.fields, options.exclude
+    if fields is None and not exclude:
+        return None
+    kept: Dict[Type[Select], Set[str]] = defaultdict(set)
+    parents: Dict[Type[Select], Tuple[Type[Select], str]] = {}
+
+    def add_all(type_: Type[Select]) -> None:
+        meta = type_.__sqlski_meta__
+        kept[type_] |= {f.name for f in meta.column_fields}
+        for relationship in meta.relationships:
+            kept[type_].add(relationship.name)
+            add_all(relationship.type)
+
+    def add_parents(type_: Type[Select]) -> None:
+        for relationship in type_.__sqlski_meta__.relationships:
+            parents[relationship.type] = (type_, relationship.name)
+            add_parents(relationship.type)
+
+    add_parents(select_type)
+    if fields is None:
+        add_all(select_type)
+    for path in fields or []:
+        steps, relationship = _resolve_path(select_type, path)
+        for type_, name in steps:
+            kept[type_].add(name)
+        if relationship is not None:
+            add_all(relationship.type)
+    for path in exclude or []:
+        steps, _ = _resolve_path(select_type, path)
+        type_, name = steps[-1]
+        kept[type_].discard(name)
+
+    def require(column: C) -> None:
+        type_ = column.select_type
+        if type_ is not select_type and type_ not in parents:
+            raise RuntimeError(f"{type_} isn't a relationship of {select_type}")
+        kept[type_].add(column.name)
+        while type_ is not select_type:
+            type_, name = parents[type_]
+            kept[type_].add(name)
+
+    for operation in [*options.filters, *options.order_by]:
+        for column in _column_args(operation):
+            require(column)
+
+    # until nothing more is needed, walking the loaded relationships
+    while True:
+        before = {type_: len(names) for type_, names in kept.items()}
+        loaded = [select_type]
+        for type_ in loaded:
+            meta = type_.__sqlski_meta__
+            names = {f.name for f in dataclass_fields(type_)}
+            ignored = [f.name for f in meta.column_fields if f.name not in names]
+            kept[type_] |= {c.name for c in meta.primary_key_columns} | set(ignored)
+            for field in meta.column_fields:
+                if field.name in kept[type_]:
+                    for column in _column_args(field.default.column):
+                        if column.select_type is not type_:
+                            require(column)
+            for relationship in meta.relationships:
+                if relationship.name not in kept[type_]:
+                    continue
+                for value in [relationship.join, *(relationship.order_by or [])]:
+                    for column in _column_args(value):
+                        require(column)
+                loaded.append(relationship.type)
+        if before == {type_: len(names) for type_, names in kept.items()}:
+            return {type_: frozenset(kept[type_]) for type_ in loaded}
+
+
 @dataclass
 class Mutable:
     grouped_filters: Dict[Type[Select], List[Operation]]
     registers: List[RegisterSqlType]
     scope: TypeToSubqueryMap
+    nesting: Nesting = make_nested
+    strategy: str = GROUP_BY
+    nested_types: List[Union[CompositeType, JsonType]] = field(default_factory=list)
+    # select type -> subquery of the primary keys to limit its rows to
+    pages: Dict[Type[Select], Alias] = field(default_factory=dict)
+    # select type -> filters to apply before joining the relationships
+    wheres: Dict[Type[Select], List[ClauseElement]] = field(default_factory=dict)
+    projection: Optional[Projection] = None
+
+
+@dataclass(frozen=True)
+class SelectOptions:
+    # the arguments of a select besides its class, the prepared selects are
+    # keyed on them, less the filter and page values, see _prepared_key
+    filters: Tuple[Operation, ...] = ()
+    nesting: Nesting = make_nested
+    order_by: Tuple[Union[C, Column, Operation], ...] = ()
+    limit: Any = None
+    after: Optional[Tuple[Any, ...]] = None
+    strategy: str = GROUP_BY
+    fields: Optional[Tuple[str, ...]] = None
+    exclude: Optional[Tuple[str, ...]] = None
+
+
+def _options(
+    filters: Optional[List[Operation]],
+    nesting: Nesting,
+    order_by: Optional[OrderBy],
+    limit: Any,
+    after: Optional[List[Any]],
+    strategy: str,
+    fields: Optional[List[str]],
+    exclude: Optional[List[str]],
+) -> SelectOptions:
+    return SelectOptions(
+        tuple(filters or ()),
+        nesting,
+        tuple(order_by or ()),
+        limit,
+        None if after is None else tuple(after),
+        strategy,
+        None if fields is None else tuple(fields),
+        None if exclude is None else tuple(exclude),
+    )
+
+
+def _copy_types(originals: List[ClauseElement], columns: Any) -> None:
+    # SQLAlchemy seems unable to preserve custom types
+    for orig, new in zip(originals, columns):
+        new.type = orig.type
+
+
+def _joined_table(select_type: Type[R], m: Mutable) -> ClauseElement:
+    joined = select_type.__sqlski_meta__.table
+    page = m.pages.get(select_type)
+    if page is not None:
+        primary_keys = select_type.__sqlski_meta__.primary_key_columns
+        on = [c.column == page.c[c.column.name] for c in primary_keys]
+        joined = joined.join(page, sa_and(*on))
+    return joined
+
+
+def _filtered(select_type: Type[R], m: Mutable, query: ClauseElement) -> ClauseElement:
+    where = m.wheres.get(select_type)
+    if where:
+        query = query.where(sa_and(*where))
+    return query
+
+
+def _projected_selects(
+    select_type: Type[R], projection: Optional[Projection]
+) -> List[Union[Column, Operation]]:
+    meta = select_type.__sqlski_meta__
+    if projection is None:
+        return meta.selects
+    names = projection[select_type]
+    return [s for f, s in zip(meta.column_fields, meta.selects) if f.name in names]
+
+
+def _nested_relationships(
+    select_type: Type[R], projection: Optional[Projection] = None
+) -> List[RelationshipBundle]:
+    meta = select_type.__sqlski_meta__
+    selectin_types = {r.type for r in meta.relationships if r.strategy == SELECTIN}
+    for column in meta.selects:
+        if isinstance(column, Operation) and _select_types(column) & selectin_types:
+            raise RuntimeError(
+                f"{select_type}.{column.label} can't use a selectin relationship"
+            )
+    names = projection_names(select_type, projection)
+    return [r for r in meta.relationships if r.strategy != SELECTIN and r.name in names]
 
 
 def get_select(select_type: Type[R], m: Mutable) -> ClauseElement:
-    relationships = select_type.__sqlski_meta__.relationships
+    relationships = _nested_relationships(select_type, m.projection)
     if not relationships:
-        query = sa_select(select_type.__sqlski_meta__.selects)
+        selects = [
+            (
+                _resolve_operation(m.scope, column).label(column.label)
+                if isinstance(column, Operation)
+                else column
+            )
+            for column in _projected_selects(select_type, m.projection)
+        ]
+        query = _filtered(select_type, m, sa_select(selects))
         return query.alias(f"_sub_{select_type.__name__.lower()}")
+    if m.strategy == LATERAL:
+        return get_lateral_select(select_type, m)
 
     extra_selects = []
     group_by = [c.column for c in select_type.__sqlski_meta__.primary_key_columns]
-    joined = select_type.__sqlski_meta__.table
-    for relationship in select_type.__sqlski_meta__.relationships:
+    joined = _joined_table(select_type, m)
+    for relationship in relationships:
         sub = get_select(relationship.type, m)
-        nested = make_nested(sub, label=relationship.name, many=relationship.is_many)
+        order_by = _resolve_order_by(
+            sub, relationship.type, relationship.order_by or []
+        )
+        nested = m.nesting(
+            sub, label=relationship.name, many=relationship.is_many, order_by=order_by
+        )
         m.scope[relationship.type] = sub
         m.registers.append(nested.register)
+        m.nested_types.append(nested.sqlalchemy_type)
         extra_selects.append(nested.expression)
         join_criteria = _resolve_operation(m.scope, relationship.join)
         filters = m.grouped_filters[relationship.type]
@@ -137,9 +585,11 @@ def get_select(select_type: Type[R], m: Mutable) -> ClauseElement:
             joined = joined.join(sub, join_criteria)
             # this is rather unfortunate, as *we* know we don't need it,
             # but the query planner doesn't
+            loaded = projection_names(relationship.type, m.projection)
             relationship_primary_key_columns = [
                 _resolve_column(m.scope, field.default)
                 for field in relationship.type.__sqlski_meta__.column_fields
+                if field.name in loaded
             ]
             group_by.extend(relationship_primary_key_columns)
 
@@ -147,33 +597,257 @@ def get_select(select_type: Type[R], m: Mutable) -> ClauseElement:
         _resolve_operation(m.scope, column).label(column.label)
         if isinstance(column, Operation)
         else column
-        for column in select_type.__sqlski_meta__.selects
+        for column in _projected_selects(select_type, m.projection)
     ]
-    query = sa_select(selects + extra_selects).select_from(joined).group_by(*group_by)
-    # SQLAlchemy seems unable to preserve custom types
-    for orig, new in zip(selects + extra_selects, query.c):
-        new.type = orig.type
+    query = sa_select(selects + extra_selects).select_from(joined)
+    query = _filtered(select_type, m, query).group_by(*group_by)
+    _copy_types(selects + extra_selects, query.c)
+    return query.alias(f"_sub_{select_type.__name__.lower()}")
+
+
+def _select_types(operation: Operation) -> Set[Type[Select]]:
+    # of the columns used, in nested operations too
+    types: Set[Type[Select]] = set()
+    for arg in _operation_args(operation):
+        if isinstance(arg, C):
+            types.add(arg.select_type)
+        elif isinstance(arg, Operation):
+            types |= _select_types(arg)
+    return types
+
+
+def get_lateral_select(select_type: Type[R], m: Mutable) -> ClauseElement:
+    # each relationship is a LATERAL subquery of the rows for one parent row,
+    # so there's no GROUP BY and Postgres can look up the children by index,
+    # aggregates of a to-many relationship's columns are moved into its
+    # LATERAL subquery
+    projected_selects = _projected_selects(select_type, m.projection)
+    resolved: Dict[int, ClauseElement] = {}
+    extra_selects = []
+    joined = _joined_table(select_type, m)
+    for relationship in _nested_relationships(select_type, m.projection):
+        sub = get_select(relationship.type, m)
+        m.scope[relationship.type] = sub
+        where = [_resolve_operation(m.scope, relationship.join)]
+        where.extend(
+            _make_and({relationship.type: sub}, m.grouped_filters[relationship.type])
+        )
+        order_by = _resolve_order_by(
+            sub, relationship.type, relationship.order_by or []
+        )
+        name = f"_lateral_{relationship.name}"
+        if relationship.is_many:
+            nested = m.nesting(
+                sub, label=relationship.name, many=True, order_by=order_by
+            )
+            aggregates = {
+                i: _resolve_operation(m.scope, column).label(column.label)
+                for i, column in enumerate(projected_selects)
+                if isinstance(column, Operation)
+                and _select_types(column) == {relationship.type}
+            }
+            columns = [nested.expression, *aggregates.values()]
+            query = sa_select(columns).select_from(sub).where(sa_and(*where))
+            lateral = query.lateral(name)
+            _copy_types(columns, lateral.c)
+            for i, aggregate in aggregates.items():
+                resolved[i] = lateral.c[aggregate.name]
+            joined = joined.outerjoin(lateral, true())
+            extra_selects.append(lateral.c[relationship.name])
+        else:
+            lateral = sa_select([sub]).where(sa_and(*where)).lateral(name)
+            _copy_types(sub.c, lateral.c)
+            m.scope[relationship.type] = lateral
+            nested = m.nesting(lateral, label=relationship.name, order_by=order_by)
+            joined = joined.join(lateral, true())
+            extra_selects.append(nested.expression)
+        m.registers.append(nested.register)
+        m.nested_types.append(nested.sqlalchemy_type)
+
+    selects = []
+    for i, column in enumerate(projected_selects):
+        if i in resolved:
+            column = resolved[i].label(column.label)
+        elif isinstance(column, Operation):
+            column = _resolve_operation(m.scope, column).label(column.label)
+        selects.append(column)
+    query = _filtered(select_type, m, sa_select(selects + extra_selects))
+    query = query.select_from(joined)
+    _copy_types(selects + extra_selects, query.c)
     return query.alias(f"_sub_{select_type.__name__.lower()}")
 
 
+def _order_keys(
+    select_type: Type[R], order_by: Sequence[Union[C, Column, Operation]]
+) -> List[Tuple[C, bool]]:
+    keys = []
+    for value in order_by:
+        descending = False
+        if isinstance(value, UnaryOperation) and value.attr in ("asc", "desc"):
+            descending = value.attr == "desc"
+            value = value.operand
+        if not isinstance(value, C) or value.select_type is not select_type:
+            raise RuntimeError(
+                f"can only order {select_type} by its fields, saw {value}"
+            )
+        keys.append((value, descending))
+    return keys
+
+
+def _order(keys: List[Tuple[ClauseElement, bool]]) -> List[ClauseElement]:
+    return [key.desc() if descending else key for key, descending in keys]
+
+
+def _keyset(keys: List[Tuple[ClauseElement, bool]], after: List[Any]) -> ClauseElement:
+    # the rows after `after` in the order of the keys, like (a, b) > (1, 2)
+    # but with a direction per key
+    if len(after) != len(keys):
+        raise RuntimeError(f"after= needs {len(keys)} values, one per order_by")
+    clauses = []
+    for i, (key, descending) in enumerate(keys):
+        equal = [k == value for (k, _), value in zip(keys, after[:i])]
+        clauses.append(sa_and(*equal, key < after[i] if descending else key > after[i]))
+    return sa_or(*clauses)
+
+
+def _inner_joined(
+    select_type: Type[R], projection: Optional[Projection]
+) -> Iterator[RelationshipBundle]:
+    # the to-one relationships, which are INNER JOINed, and theirs
+    for relationship in _nested_relationships(select_type, projection):
+        if not relationship.is_many:
+            yield relationship
+            yield from _inner_joined(relationship.type, projection)
+
+
+def _always_joined(relationship: RelationshipBundle) -> bool:
+    # whether every parent row has a child, ie. the join is on a NOT NULL
+    # foreign key to the child's column
+    try:
+        parent, child = relationship.selectin_keys
+    except RuntimeError:
+        return False
+    column = parent.column
+    return (
+        isinstance(column, Column)
+        and not column.nullable
+        and any(fk.column is child.column for fk in column.foreign_keys)
+    )
+
+
+def _page(
+    select_type: Type[R],
+    m: Mutable,
+    keys: List[Tuple[C, bool]],
+    limit: Any,
+    after: Optional[List[Any]],
+) -> Optional[Alias]:
+    # the primary keys of one page of rows, so the LIMIT is applied before
+    # the relationships are joined and aggregated, None if the filters or
+    # ordering depend on a relationship, or if an INNER JOINed one could drop
+    # rows of the page
+    for relationship in _inner_joined(select_type, m.projection):
+        if m.grouped_filters.get(relationship.type) or not _always_joined(relationship):
+            return None
+    operations = m.grouped_filters[select_type]
+    try:
+        where = [_table_expression(select_type, o) for o in operations]
+        table_keys = [(_table_expression(select_type, c), d) for c, d in keys]
+    except _NeedsRelationship:
+        return None
+    if after is not None:
+        where.append(_keyset(table_keys, after))
+    primary_keys = [c.column for c in select_type.__sqlski_meta__.primary_key_columns]
+    query = sa_select(primary_keys)
+    if where:
+        query = query.where(sa_and(*where))
+    query = query.order_by(*_order(table_keys)).limit(limit)
+    return query.alias(f"_page_{select_type.__name__.lower()}")
+
+
 def to_select(
-    select_type: Type[R], filters: Optional[List[Operation]] = None
+    select_type: Type[R],
+    filters: Optional[List[Operation]] = None,
+    nesting: Nesting = make_nested,
+    order_by: Optional[OrderBy] = None,
+    limit: Any = None,
+    after: Optional[List[Any]] = None,
+    strategy: str = GROUP_BY,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
 ) -> QueryBundle:
+    # fields=/exclude= are dotted paths of the fields to load/leave out, eg.
+    # ["customer_id", "baskets.basket_id"], see _project
+    options = _options(
+        filters, nesting, order_by, limit, after, strategy, fields, exclude
+    )
+    return _to_select(select_type, options, _project(select_type, options))
+
+
+def _to_select(
+    select_type: Type[R], options: SelectOptions, projection: Optional[Projection]
+) -> QueryBundle:
+    strategy, limit, after = options.strategy, options.limit, options.after
+    if strategy not in STRATEGIES:
+        raise RuntimeError(f"strategy must be one of {STRATEGIES}, saw {strategy}")
     m = Mutable(
-        grouped_filters=_group_filters(filters or []),
+        grouped_filters=_group_filters(options.filters),
         registers=[],
         scope={
             d: d.__sqlski_meta__.table for d in select_type.__sqlski_meta__.descendants
         },
+        nesting=options.nesting,
+        strategy=strategy,
+        projection=projection,
     )
-    sub = get_select(select_type, m)
     operations = m.grouped_filters[select_type]
-    if operations:
+    keys = _order_keys(select_type, options.order_by)
+    if after is not None and not keys:
+        raise RuntimeError("after= requires an order_by")
+    if after is not None:
+        # rows with NULLs would never be after the previous page
+        for key, _ in keys:
+            if isinstance(key.column, Column) and key.column.nullable:
+                raise RuntimeError(f"after= can't order by nullable {key.name}")
+    page = None
+    if _nested_relationships(select_type, projection):
+        if limit is not None:
+            page = _page(select_type, m, keys, limit, after)
+        if page is not None:
+            m.pages[select_type] = page
+            operations = []
+        else:
+            m.wheres[select_type], operations = _push_down(select_type, operations)
+    # the filters of the relationships on just their tables are applied in
+    # their subqueries, before the joins and GROUP BYs below them, the rest
+    # are left to the ON clause of their join
+    for type_ in select_type.__sqlski_meta__.descendants[1:]:
+        if m.grouped_filters[type_]:
+            pushed, m.grouped_filters[type_] = _push_down(
+                type_, m.grouped_filters[type_]
+            )
+            m.wheres[type_] = pushed
+
+    sub = get_select(select_type, m)
+    sub_keys = [(sub.c[c.name], descending) for c, descending in keys]
+    if page is not None:
+        query = sa_select([sub]).order_by(*_order(sub_keys))
+    elif operations or keys or limit is not None:
+        where = _make_and({select_type: sub}, operations)
+        if after is not None:
+            where.append(_keyset(sub_keys, after))
         query = sa_select([sub])
-        query = query.where(sa_and(*_make_and({select_type: sub}, operations)))
+        if where:
+            query = query.where(sa_and(*where))
+        query = query.order_by(*_order(sub_keys)).limit(limit)
     else:
         query = sub.original
-    return QueryBundle(query=query, registers=m.registers, scope=m.scope)
+    return QueryBundle(
+        query=query,
+        registers=m.registers,
+        scope=m.scope,
+        nested_types=m.nested_types,
+    )
 
 
 def _make_and(
@@ -182,17 +856,28 @@ def _make_and(
     return [_resolve_operation(scope, operation) for operation in operations]
 
 
-def _group_filters(filters: List[Operation]) -> Dict[Type[Select], List[Operation]]:
+def _operation_args(operation: Operation) -> List[Any]:
+    if isinstance(operation, BinOperation):
+        return [operation.left, operation.right]
+    if isinstance(operation, Func):
+        return list(operation.args)
+    if isinstance(operation, UnaryOperation):
+        return [operation.operand]
+    raise RuntimeError(f"Unsupported operation type: {operation.__class__}")
+
+
+def _with_args(operation: Operation, args: List[Any]) -> Operation:
+    if isinstance(operation, BinOperation):
+        return BinOperation(args[0], args[1], operation.attr)
+    if isinstance(operation, UnaryOperation):
+        return UnaryOperation(args[0], operation.attr)
+    return Func(args, operation.attr)
+
+
+def _group_filters(filters: Sequence[Operation]) -> Dict[Type[Select], List[Operation]]:
     grouped_filters: Dict[Type[Select], List[Operation]] = defaultdict(list)
     for operation in filters:
-        if isinstance(operation, BinOperation):
-            columns = [operation.left, operation.right]
-        elif isinstance(operation, Func):
-            columns = operation.args
-        else:
-            raise RuntimeError(f"Unsupported operation type: {operation.__class__}")
-
-        columns = [c for c in columns if isinstance(c, C)]
+        columns = [c for c in _operation_args(operation) if isinstance(c, C)]
         result_types = {c.select_type for c in columns}
         if len(result_types) != 1:
             raise RuntimeError(
@@ -202,28 +887,509 @@ def _group_filters(filters: List[Operation]) -> Dict[Type[Select], List[Operatio
     return grouped_filters
 
 
-def _from_relationship_field(field: Any, row: Any) -> Any:
-    is_many, select_type = to_is_many_and_type(field.type)
-    if is_many:
-        return [from_row(select_type, n) for n in getattr(row, field.name)]
-    else:
-        return from_row(select_type, getattr(row, field.name))
+def _filter_shape(filters: Sequence[Operation]) -> Optional[Hashable]:
+    shape = []
+    for operation in filters:
+        args = []
+        for arg in _operation_args(operation):
+            if isinstance(arg, C):
+                args.append((arg.select_type, arg.name))
+            elif arg is None:
+                # compiles differently, eg. `IS NULL`
+                args.append(None)
+            elif isinstance(arg, ClauseElement):
+                return None
+            else:
+                args.append("bind")
+        shape.append((operation.__class__, operation.attr, tuple(args)))
+    return tuple(shape)
+
+
+def _parametrize_filters(
+    filters: Sequence[Operation],
+) -> Tuple[List[Operation], Dict[str, Any]]:
+    parametrized: List[Operation] = []
+    params: Dict[str, Any] = {}
+    for operation in filters:
+        args = []
+        for arg in _operation_args(operation):
+            if not isinstance(arg, C) and arg is not None:
+                name = f"_filter_{len(params)}"
+                params[name] = arg
+                arg = bindparam(name)
+            args.append(arg)
+        parametrized.append(_with_args(operation, args))
+    return parametrized, params
+
+
+def _parametrize_page(
+    limit: Optional[int], after: Optional[List[Any]]
+) -> Tuple[Any, Optional[List[Any]], Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    if limit is not None:
+        params["_limit"] = limit
+        limit = bindparam("_limit")
+    if after is not None:
+        names = [f"_after_{i}" for i in range(len(after))]
+        params.update(zip(names, after))
+        after = [bindparam(name) for name in names]
+    return limit, after, params
+
+
+def _prepared_key(
+    select_type: Type[R], options: SelectOptions, projection: Optional[Projection]
+) -> Optional[Hashable]:
+    # the options with the filter/page values left out, the same for selects
+    # differing only in those
+    shape = _filter_shape(options.filters)
+    if shape is None:
+        return None
+    order_shape = tuple(
+        (c.select_type, c.name, descending)
+        for c, descending in _order_keys(select_type, options.order_by)
+    )
+    after = options.after
+    shape_options = replace(
+        options,
+        filters=shape,
+        order_by=order_shape,
+        limit=options.limit is not None,
+        after=None if after is None else len(after),
+    )
+    return (shape_options, projection_key(projection))
+
+
+def prepare_select(
+    select_type: Type[R],
+    filters: Optional[List[Operation]] = None,
+    nesting: Nesting = make_nested,
+    order_by: Optional[OrderBy] = None,
+    limit: Optional[int] = None,
+    after: Optional[List[Any]] = None,
+    strategy: str = GROUP_BY,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+) -> Tuple[PreparedSelect, Dict[str, Any]]:
+    options = _options(
+        filters, nesting, order_by, limit, after, strategy, fields, exclude
+    )
+    return _prepare_select(select_type, options, _project(select_type, options))
+
+
+def _prepare_select(
+    select_type: Type[R], options: SelectOptions, projection: Optional[Projection]
+) -> Tuple[PreparedSelect, Dict[str, Any]]:
+    key = _prepared_key(select_type, options, projection)
+    parametrized, params = _parametrize_filters(options.filters)
+    limit, after, page_params = _parametrize_page(options.limit, options.after)
+    params.update(page_params)
+    prepared_selects = select_type.__sqlski_meta__.prepared_selects
+    if key is None or key not in prepared_selects:
+        with _phase("build", select_type):
+            parametrized_options = replace(
+                options, filters=tuple(parametrized), limit=limit, after=after
+            )
+            extras = _to_select(select_type, parametrized_options, projection)
+        prepared = PreparedSelect(
+            extras.query,
+            extras.registers,
+            extras.scope,
+            extras.nested_types,
+            select_type=select_type,
+            projection=projection,
+            cached=key is not None,
+        )
+        if key is None:
+            return prepared, params
+        prepared_selects[key] = prepared
+    return prepared_selects[key], params
 
 
-def from_row(select_type: Type[R], row: Any) -> R:
-    d = {}
-    for field in fields(select_type):
-        if isinstance(field.default, Relationship):
-            d[field.name] = _from_relationship_field(field, row)
+def _stable(value: Any) -> Any:
+    # classes and functions by name, so the repr is the same in any process
+    if isinstance(value, (list, tuple)):
+        return tuple(_stable(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((_stable(v) for v in value), key=repr))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _stable(v)) for k, v in value.items()))
+    if isinstance(value, SelectOptions):
+        return tuple(
+            (f.name, _stable(getattr(value, f.name))) for f in dataclass_fields(value)
+        )
+    if isinstance(value, type) or callable(value):
+        return f"{value.__module__}.{value.__qualname__}"
+    return value
+
+
+def _cache_key(
+    database: str,
+    select_type: Type[R],
+    options: SelectOptions,
+    identity_map: bool,
+    projection: Optional[Projection],
+) -> Optional[str]:
+    key = _prepared_key(select_type, options, projection)
+    if key is None:
+        return None
+    _, params = _parametrize_filters(options.filters)
+    params.update(_parametrize_page(options.limit, options.after)[2])
+    return repr(_stable((database, select_type, key, identity_map, params)))
+
+
+def _tables(select_type: Type[R]) -> FrozenSet[str]:
+    descendants = select_type.__sqlski_meta__.descendants
+    return frozenset(d.__sqlski_meta__.table.fullname for d in descendants)
+
+
+def _cached(
+    cache: Cache,
+    database: str,
+    select_type: Type[R],
+    options: SelectOptions,
+    identity_map: bool,
+) -> Tuple[Optional[str], Optional[List[R]]]:
+    # the key of the select in the cache, None if it can't be cached, and the
+    # cached instances if there are any, database is eg. the engine's URL (the
+    # repr, without the password)
+    projection = _project(select_type, options)
+    key = _cache_key(database, select_type, options, identity_map, projection)
+    if key is None:
+        return None, None
+    _remember(cache)
+    with _phase("cache", select_type) as event:
+        instances = cache.get(key)
+        if event is not None:
+            event.details["hit"] = instances is not None
+    # copies, as the callers may change them
+    return key, None if instances is None else deepcopy(instances)
+
+
+def _cache_set(cache: Cache, key: str, select_type: Type[R], instances: List[R]):
+    cache.set(key, deepcopy(instances), _tables(select_type))
+
+
+def _decoder(
+    select_type: Type[R],
+    identities: Optional[Dict[Hashable, Any]],
+    shared: bool = False,
+    projection: Optional[Projection] = None,
+) -> Callable[[Any], R]:
+    decoder, identity_decoder, shared_decoder = decoders(select_type, projection)
+    if identities is None:
+        return decoder
+    decoder = shared_decoder if shared else identity_decoder
+    return partial(decoder, identities=identities)
+
+
+def from_row(
+    select_type: Type[R], row: Any, identities: Optional[Dict[Hashable, Any]] = None
+) -> R:
+    # pass the same identities dict for all the rows to decode nested rows
+    # with the same primary key just once, as the one shared instance
+    #
+    # the decoders read the columns by position, in the order of the rows of
+    # to_select(select_type).query, rows with other columns are read by name
+    names = select_type.__sqlski_meta__.row_names
+    keys = row.keys() if hasattr(row, "keys") else getattr(row, "_fields", None)
+    if len(row) != len(names) or (keys is not None and list(keys) != names):
+        row = [getattr(row, name) for name in names]
+    return _decoder(select_type, identities)(row)
+
+
+def _count_relationships(
+    event: PhaseEvent, select_type: Type[R], instances: List[R]
+) -> None:
+    for relationship in select_type.__sqlski_meta__.relationships:
+        children = [
+            child
+            for instance in instances
+            for child in _as_list(getattr(instance, relationship.name))
+            if not isinstance(child, Pending)
+        ]
+        rows = event.relationship_rows
+        rows[relationship.name] = rows.get(relationship.name, 0) + len(children)
+        _count_relationships(event, relationship.type, children)
+
+
+def _decode_all(
+    select_type: Type[R],
+    decoder: Callable[[Any], R],
+    fetch: Callable[[], List[Any]],
+    relationship: Optional[RelationshipBundle] = None,
+) -> Tuple[List[Any], List[R]]:
+    # psycopg2 casts the values as they're fetched, so that's timed too
+    with _phase("decode", select_type) as event:
+        rows = fetch()
+        instances = list(map(decoder, rows))
+        if event is not None:
+            event.rows = len(instances)
+            if relationship is not None:
+                event.relationship_rows[relationship.name] = len(instances)
+            _count_relationships(event, select_type, instances)
+    return rows, instances
+
+
+def _decode_rows(
+    select_type: Type[R], decoder: Callable[[Any], R], rows: Any
+) -> Iterator[R]:
+    # lazily, unless the phases are timed
+    if not timed():
+        return map(decoder, rows)
+    _, instances = _decode_all(select_type, decoder, rows.fetchall)
+    return iter(instances)
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None or isinstance(value, Unloaded):
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _pending_parents(
+    select_type: Type[R], instances: List[R]
+) -> Iterator[Tuple[RelationshipBundle, List[Any]]]:
+    for path, relationship in select_type.__sqlski_meta__.selectins:
+        parents = instances
+        for name in path:
+            parents = [c for p in parents for c in _as_list(getattr(p, name))]
+        # shared instances can be reached more than once, or be loaded already
+        # by an earlier batch
+        pending = {
+            id(p): p
+            for p in parents
+            if isinstance(getattr(p, relationship.name), Pending)
+        }
+        yield relationship, list(pending.values())
+
+
+def _selectin_query(
+    relationship: RelationshipBundle,
+    parents: List[Any],
+    options: SelectOptions,
+    projection: Optional[Projection] = None,
+) -> Optional[Tuple[PreparedSelect, Dict[str, Any]]]:
+    keys = {getattr(p, relationship.name).key for p in parents} - {None}
+    if not keys:
+        return None
+    return _selectin_select(relationship, keys, options, projection)
+
+
+def _selectin_select(
+    relationship: RelationshipBundle,
+    keys: Set[Any],
+    options: SelectOptions,
+    projection: Optional[Projection] = None,
+) -> Tuple[PreparedSelect, Dict[str, Any]]:
+    # options are those of the top level select, its filters of the
+    # relationship's types apply
+    _, child_key = relationship.selectin_keys
+    grouped_filters = _group_filters(options.filters)
+    descendants = relationship.type.__sqlski_meta__.descendants
+    filters = [f for type_ in descendants for f in grouped_filters[type_]]
+    child_options = SelectOptions(
+        filters=(child_key.in_(keys), *filters),
+        nesting=options.nesting,
+        order_by=tuple(relationship.order_by or ()),
+        strategy=options.strategy,
+    )
+    return _prepare_select(relationship.type, child_options, projection)
+
+
+def _selectin_selects(
+    select_type: Type[R],
+    options: SelectOptions,
+    projection: Optional[Projection] = None,
+) -> Iterator[PreparedSelect]:
+    # the queries of every selectin relationship below select_type, whatever
+    # the keys, so their types can be registered before a stream is opened
+    for _, relationship in select_type.__sqlski_meta__.selectins:
+        yield _selectin_select(relationship, {None}, options, projection)[0]
+        yield from _selectin_selects(relationship.type, options, projection)
+
+
+def _key_position(
+    relationship: RelationshipBundle, projection: Optional[Projection] = None
+) -> int:
+    _, child_key = relationship.selectin_keys
+    column_fields = relationship.type.__sqlski_meta__.column_fields
+    loaded = projection_names(relationship.type, projection)
+    names = [f.name for f in column_fields if f.name in loaded]
+    return names.index(child_key.name)
+
+
+def _stitch(
+    relationship: RelationshipBundle,
+    parents: List[Any],
+    children: List[Tuple[Any, Any]],
+) -> None:
+    groups: Dict[Any, List[Any]] = defaultdict(list)
+    for key, child in children:
+        groups[key].append(child)
+    for parent in parents:
+        group = groups.get(getattr(parent, relationship.name).key, [])
+        if relationship.is_many:
+            value = list(group)
         else:
-            d[field.name] = getattr(row, field.name)
-    return select_type(**d)
+            value = group[0] if group else None
+        # frozen classes too
+        object.__setattr__(parent, relationship.name, value)
+
+
+def _load_selectins(
+    conn: Connection,
+    select_type: Type[R],
+    instances: List[R],
+    options: SelectOptions,
+    identities: Optional[Dict[Hashable, Any]] = None,
+    projection: Optional[Projection] = None,
+) -> None:
+    # replaces the Pending values of SELECTIN relationships, with a query per
+    # relationship for all the instances, the children are matched to their
+    # parents by the column of the join
+    for relationship, parents in _pending_parents(select_type, instances):
+        query = _selectin_query(relationship, parents, options, projection)
+        children = []
+        if query is not None:
+            prepared, params = query
+            for register in prepared.registers:
+                register(conn)
+            position = _key_position(relationship, projection)
+            decoder = _decoder(relationship.type, identities, True, projection)
+            fetch = prepared.execute(conn, params).fetchall
+            rows, instances = _decode_all(
+                relationship.type, decoder, fetch, relationship
+            )
+            children = [(row[position], i) for row, i in zip(rows, instances)]
+            _load_selectins(
+                conn, relationship.type, instances, options, identities, projection
+            )
+        _stitch(relationship, parents, children)
+
+
+def _from_batches(
+    select_type: Type[R],
+    fetch: Callable[[], List[Any]],
+    load: Callable,
+    decoder: Callable[[Any], R],
+    batch_size: Optional[int] = None,
+) -> Iterator[R]:
+    # until a batch is short of batch_size, just the one without
+    while True:
+        _, instances = _decode_all(select_type, decoder, fetch)
+        if instances and select_type.__sqlski_meta__.selectins:
+            load(instances)
+        yield from instances
+        if batch_size is None or len(instances) < batch_size:
+            return
 
 
 def do_select(
-    conn: Connection, select_type: Type[R], filters: Optional[List[Operation]] = None
+    conn: Connection,
+    select_type: Type[R],
+    filters: Optional[List[Operation]] = None,
+    stream: bool = False,
+    batch_size: int = 1000,
+    nesting: Nesting = make_nested,
+    order_by: Optional[OrderBy] = None,
+    limit: Optional[int] = None,
+    after: Optional[List[Any]] = None,
+    strategy: str = GROUP_BY,
+    identity_map: bool = False,
+    cache: Optional[Cache] = None,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
 ) -> Iterator[R]:
-    extras = to_select(select_type, filters=filters)
-    for register in extras.registers:
+    # with limit= the page of select_type rows is found before the
+    # relationships are nested, after= is the order_by values of the last
+    # row of the previous page, with identity_map=True nested rows with the
+    # same primary key are decoded once, as the one shared instance, the
+    # fields left out by fields=/exclude= are UNLOADED
+    options = _options(
+        filters, nesting, order_by, limit, after, strategy, fields, exclude
+    )
+    if cache is not None and not stream:
+        database = repr(conn.engine.url)
+        key, instances = _cached(cache, database, select_type, options, identity_map)
+        if key is not None:
+            if instances is None:
+                instances = list(
+                    _do_select(conn, select_type, options, False, 0, identity_map)
+                )
+                _cache_set(cache, key, select_type, instances)
+            return iter(instances)
+    return _do_select(conn, select_type, options, stream, batch_size, identity_map)
+
+
+def _do_select(
+    conn: Connection,
+    select_type: Type[R],
+    options: SelectOptions,
+    stream: bool,
+    batch_size: int,
+    identity_map: bool,
+) -> Iterator[R]:
+    projection = _project(select_type, options)
+    prepared, params = _prepare_select(select_type, options, projection)
+    for register in prepared.registers:
         register(conn)
-    return (from_row(select_type, row) for row in conn.execute(extras.query))
+    identities: Optional[Dict[Hashable, Any]] = {} if identity_map else None
+    decoder = _decoder(select_type, identities, projection=projection)
+
+    def load(instances: List[R]) -> None:
+        _load_selectins(conn, select_type, instances, options, identities, projection)
+
+    if stream:
+        # use a named (server side) cursor, only holding batch_size rows at
+        # once, outside a transaction the CREATE TYPEs of the selectins would
+        # commit and close it between batches
+        for selectin in _selectin_selects(select_type, options, projection):
+            for register in selectin.registers:
+                register(conn)
+        stream_options = dict(stream_results=True, max_row_buffer=batch_size)
+        rows = prepared.execute(conn.execution_options(**stream_options), params)
+        fetch = partial(rows.fetchmany, batch_size)
+        return _from_batches(select_type, fetch, load, decoder, batch_size)
+    rows = prepared.execute(conn, params)
+    if select_type.__sqlski_meta__.selectins:
+        return _from_batches(select_type, rows.fetchall, load, decoder)
+    return _decode_rows(select_type, decoder, rows)
+
+
+def install_types(
+    engine: Engine, selects: List[Union[Type[Select], QueryBundle]]
+) -> List[str]:
+    # creates the types of make_installed_nested for the select classes (for
+    # each strategy, and the selects of their selectin relationships) or
+    # to_select(..., nesting=make_installed_nested) queries, eg. at deploy
+    # time, returns the names of the types that didn't exist yet
+    types: Dict[str, CompositeType] = {}
+    for select_ in selects:
+        if isinstance(select_, QueryBundle):
+            bundles = [select_]
+        else:
+            bundles = [
+                to_select(type_, nesting=make_installed_nested, strategy=strategy)
+                for type_ in select_.__sqlski_meta__.descendants
+                for strategy in STRATEGIES
+            ]
+        for bundle in bundles:
+            # children come before their parents
+            for type_ in bundle.nested_types:
+                if isinstance(type_, CompositeType) and type_.schema is not None:
+                    types.setdefault(type_.name, type_)
+    existing = text(
+        "SELECT typname FROM pg_type JOIN pg_namespace n ON n.oid = typnamespace "
+        "WHERE nspname = :schema"
+    )
+    created = []
+    with engine.begin() as conn:
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {INSTALLED_SCHEMA}")
+        names = {name for [name] in conn.execute(existing, schema=INSTALLED_SCHEMA)}
+        for name, type_ in types.items():
+            if name not in names:
+                conn.execute(CreateType(name, type_.columns, INSTALLED_SCHEMA))
+                created.append(name)
+    # the types may have been dropped and installed again with new oids
+    forget_installed()
+    return created
@@ -0,0 +1,115 @@
+# Server-side prepared statements for cached select shapes, opt in with the
+# sqlski_prepare execution option, eg. conn.execution_options(sqlski_prepare=True)
+# or create_engine(..., execution_options={"sqlski_prepare": True}).
+#
+# A prepare_select query is PREPAREd the first time it's run on a (DBAPI)
+# connection and EXECUTEd with its bind parameters after that, so Postgres
+# parses and plans the nested SQL once per connection rather than per call.
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, Tuple
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.dialects.postgresql.base import PGCompiler, PGDialect
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import bindparam, column, text
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.elements import TextClause
+
+from .composite import _CREATED_KEY, _STATEMENTS_KEY, CompositeType
+from .events import _phase
+
+
+class DollarCompiler(PGCompiler):
+    def bindparam_string(self, name, **kw):
+        # $1, $2, ... rather than the numeric paramstyle's :1, :2, ...
+        return "$" + super().bindparam_string(name, **kw)[1:]
+
+
+class DollarDialect(PGDialect):
+    statement_compiler = DollarCompiler
+
+    def __init__(self, **kwargs):
+        super().__init__(paramstyle="numeric", **kwargs)
+
+
+dialect = DollarDialect()
+
+
+@dataclass
+class Statement:
+    name: str
+    # PREPARE name AS ..., the query with its bind parameters as $1, $2, ...
+    prepare: str
+    # EXECUTE name(...), typed like the query's binds and result columns, so
+    # the dialect processes them as it would the query's
+    execute: TextClause
+    compiled: SQLCompiler
+    # the temporary composite types used, DROP TYPE ... CASCADE of any of
+    # them invalidates the statement
+    type_names: Tuple[str, ...]
+
+    def params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        # including the binds with fixed values, they're parameters too
+        values = self.compiled.construct_params(params)
+        return {f"_p{i}": values[n] for i, n in enumerate(self.compiled.positiontup)}
+
+
+_statements: "WeakKeyDictionary[Any, Statement]" = WeakKeyDictionary()
+
+
+def _statement(prepared: Any) -> Statement:
+    compiled = prepared.query.compile(dialect=dialect)
+    digest = hashlib.sha1(compiled.string.encode()).hexdigest()[:16]
+    name = f"sqlski_{digest}"
+    binds = [
+        bindparam(f"_p{i}", type_=compiled.binds[n].type)
+        for i, n in enumerate(compiled.positiontup)
+    ]
+    arguments = ", ".join(f":{b.key}" for b in binds)
+    execute = text(f"EXECUTE {name}({arguments})" if binds else f"EXECUTE {name}")
+    execute = execute.bindparams(*binds).columns(
+        *[column(c.name, c.type) for c in prepared.query.c]
+    )
+    type_names = tuple(
+        t.name
+        for t in prepared.nested_types
+        if isinstance(t, CompositeType) and t.schema is None
+    )
+    return Statement(
+        name, f"PREPARE {name} AS {compiled.string}", execute, compiled, type_names
+    )
+
+
+def _statement_for(prepared: Any) -> Statement:
+    statement = _statements.get(prepared)
+    if statement is None:
+        with _phase("compile", prepared.select_type):
+            statement = _statements[prepared] = _statement(prepared)
+    return statement
+
+
+def _versions(conn: Connection, statement: Statement) -> Tuple[int, ...]:
+    created = conn.connection.info.get(_CREATED_KEY, {})
+    return tuple(created.get(name, 0) for name in statement.type_names)
+
+
+def execute_prepared(conn: Connection, prepared: Any, params: Dict[str, Any]) -> Any:
+    # PREPAREs aren't undone by a rollback, but the temporary types they use
+    # may be, so they're remembered with the versions of those types
+    statement = _statement_for(prepared)
+    statements = conn.connection.info.setdefault(_STATEMENTS_KEY, {})
+    versions = _versions(conn, statement)
+    if statements.get(statement.name) != versions:
+        with _phase("prepare", prepared.select_type):
+            raw = conn.execution_options(no_parameters=True)
+            if statement.name in statements:
+                raw.execute(f"DEALLOCATE {statement.name}")
+                del statements[statement.name]
+            raw.execute(statement.prepare)
+        statements[statement.name] = versions
+    with _phase("execute", prepared.select_type) as event:
+        result = conn.execute(statement.execute, statement.params(params))
+        if event is not None and result.rowcount >= 0:
+            event.rows = result.rowcount
+    return result
@@ -1,16 +1,39 @@
 from __future__ import annotations
 
 from dataclasses import Field, dataclass, field, fields
-from typing import Callable, Dict, Iterator, List, Optional, Tuple, Type, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from sqlalchemy import Column, Table
 from sqlalchemy.engine import Connection
 from sqlalchemy.sql import ClauseElement
 
 from .composite import CompositeType
+from .events import _phase
+from .jsonagg import JsonType
+from .statements import execute_prepared
 
 RegisterSqlType = Callable[[Connection], ClauseElement]
 
+# how relationships are loaded, GROUP_BY and LATERAL nest them in the one
+# query (see select.get_select), SELECTIN loads them with a query per level
+GROUP_BY = "group_by"
+LATERAL = "lateral"
+SELECTIN = "selectin"
+
 
 class Operation:
     label: Optional[str] = None
@@ -29,6 +52,12 @@ class Func(Operation):
     attr: str
 
 
+@dataclass
+class UnaryOperation(Operation):
+    operand: C
+    attr: str
+
+
 class Select:
     __sqlski_meta__: ResultMeta = None
 
@@ -43,11 +72,15 @@ T = TypeVar("T")
 
 @dataclass
 class Nested:
-    sqlalchemy_type: CompositeType
+    sqlalchemy_type: Union[CompositeType, JsonType]
     expression: ClauseElement
     register: RegisterSqlType
 
 
+# eg. select.make_nested, called with (columns, label, many, order_by)
+Nesting = Callable[..., Nested]
+
+
 @dataclass
 class RelationshipBundle:
     name: str
@@ -55,6 +88,22 @@ class RelationshipBundle:
     is_many: bool
     join: Operation
     order_by: Optional[List[Union[Column, Operation]]]
+    strategy: Optional[str] = None
+
+    @property
+    def selectin_keys(self) -> Tuple[C, C]:
+        # the (parent, child) columns a SELECTIN relationship is joined on
+        join = self.join
+        if not (isinstance(join, BinOperation) and join.attr == "__eq__"):
+            raise RuntimeError(f"{self.name} must be joined with == to use selectin")
+        columns = [join.left, join.right]
+        if not all(isinstance(c, C) for c in columns):
+            raise RuntimeError(f"{self.name} must join two columns to use selectin")
+        if columns[0].select_type is self.type:
+            columns.reverse()
+        if columns[1].select_type is not self.type:
+            raise RuntimeError(f"{self.name} must join on a {self.type} column")
+        return columns[0], columns[1]
 
 
 @dataclass
@@ -73,6 +122,25 @@ class ResultMeta:
     selects: List[Union[Column, Operation]]
     relationships: List[RelationshipBundle]
     descendants: List[Type[R]] = field(default_factory=list)
+    # (path of nested relationship names, SELECTIN relationship at the end)
+    selectins: List[Tuple[Tuple[str, ...], RelationshipBundle]] = field(
+        default_factory=list
+    )
+    # filter shape -> PreparedSelect, populated by select.prepare_select
+    prepared_selects: Dict[Hashable, PreparedSelect] = field(default_factory=dict)
+    # row -> instance, generated by the select decorator
+    decoder: Callable[[Any], Any] = None
+    # the names of the columns decoder reads, in order, see select.from_row
+    row_names: List[str] = field(default_factory=list)
+    # (row, identities) -> instance, as decoder but nested instances are
+    # looked up in/added to identities by (class, primary key values), the
+    # shared_decoder looks up the instance itself too
+    identity_decoder: Callable[[Any, Dict[Hashable, Any]], Any] = None
+    shared_decoder: Callable[[Any, Dict[Hashable, Any]], Any] = None
+    # projection_key -> decoders for the projection, see decoders()
+    projected_decoders: Dict[Hashable, Tuple[Callable[..., Any], ...]] = field(
+        default_factory=dict
+    )
 
 
 @dataclass
@@ -97,6 +165,15 @@ class C:
     def __mul__(self, other: C):
         return BinOperation(self, other, "__mul__")
 
+    def in_(self, values: Iterable[Any]):
+        return BinOperation(self, list(values), "in_")
+
+    def asc(self):
+        return UnaryOperation(self, "asc")
+
+    def desc(self):
+        return UnaryOperation(self, "desc")
+
 
 class _FuncMaker:
     def __getattr__(self, attr):
@@ -110,6 +187,8 @@ func = _FuncMaker()
 class Relationship:
     join: Operation
     order_by: Optional[List[Union[Column, Operation]]] = None
+    # SELECTIN to load with a separate query, otherwise nested in the query
+    strategy: Optional[str] = None
     # these get written by the select|insert decorator
     select_type: Type[Select] = None
     name: str = None
@@ -128,6 +207,9 @@ class InsertUsing:
 
 
 TypeToSubqueryMap = Dict[Type[Select], ClauseElement]
+# select type -> the names of the fields (and Ignore fields) to load, the
+# types that aren't loaded at all are left out, see select._project
+Projection = Dict[Type[Select], FrozenSet[str]]
 
 
 @dataclass
@@ -135,10 +217,72 @@ class QueryBundle:
     query: ClauseElement
     registers: List[RegisterSqlType]
     scope: TypeToSubqueryMap  # TODO: test the scope is correct
+    nested_types: List[Union[CompositeType, JsonType]] = field(default_factory=list)
 
 
-def select(cls) -> Select:
-    cls = dataclass(cls)
+class Unloaded:
+    # the value of the fields left out by fields=/exclude=
+    def __repr__(self) -> str:
+        return "UNLOADED"
+
+    def __reduce__(self) -> str:
+        # so copies and pickles are UNLOADED too
+        return "UNLOADED"
+
+
+UNLOADED = Unloaded()
+
+
+@dataclass
+class Pending:
+    # placeholder for a SELECTIN relationship, see select.load_selectins
+    key: Any
+
+
+@dataclass(eq=False)
+class PreparedSelect:
+    # as QueryBundle, but filter values are bind parameters to be passed
+    # at execution time, so the query can be built and compiled just once
+    query: ClauseElement
+    registers: List[RegisterSqlType]
+    scope: TypeToSubqueryMap
+    nested_types: List[Union[CompositeType, JsonType]] = field(default_factory=list)
+    # dialect -> Compiled
+    compiled_cache: Dict[Any, Any] = field(default_factory=dict)
+    select_type: Any = None
+    projection: Optional[Projection] = None
+    # whether it's one of the select type's prepared_selects
+    cached: bool = False
+
+    def execute(self, conn: Connection, params: Dict[str, Any]) -> Any:
+        options = conn.get_execution_options()
+        # named cursors can only DECLARE a SELECT, not EXECUTE one
+        if (
+            self.cached
+            and options.get("sqlski_prepare")
+            and not options.get("stream_results")
+        ):
+            return execute_prepared(conn, self, params)
+        compiled = self.compiled_cache.get(conn.dialect)
+        if compiled is None:
+            with _phase("compile", self.select_type):
+                compiled = self.query.compile(dialect=conn.dialect)
+            self.compiled_cache[conn.dialect] = compiled
+        with _phase("execute", self.select_type) as event:
+            result = conn.execute(compiled, params)
+            if event is not None and result.rowcount >= 0:
+                event.rows = result.rowcount
+        return result
+
+
+def select(cls=None, *, slots: bool = False, frozen: bool = False) -> Select:
+    # @select or @select(slots=True, frozen=True), slots makes the instances
+    # __slots__ rather than __dict__ based, so a lot smaller
+    if cls is None:
+        return lambda cls: select(cls, slots=slots, frozen=frozen)
+    if slots:
+        cls = _with_slots(cls)
+    cls = dataclass(cls, frozen=frozen)
 
     def __repr__(self) -> str:
         values = [
@@ -146,35 +290,235 @@ def select(cls) -> Select:
         ]
         return f"{cls.__name__}({', '.join(values)})"
 
+    # the fields are only walked once, the meta of the relationships' types
+    # is reused rather than walking them again
+    column_fields = list(_yield_column_fields(cls))
+    table = _get_table(column_fields)
     meta = ResultMeta(
-        table=_get_table(cls),
-        column_fields=list(_yield_column_fields(cls)),
-        primary_key_columns=list(_yield_primary_key_columns(cls)),
-        selects=list(_yield_selects(cls)),
+        table=table,
+        column_fields=column_fields,
+        primary_key_columns=list(_yield_primary_key_columns(column_fields, table)),
+        selects=list(_yield_selects(column_fields)),
         relationships=list(_yield_relationships(cls)),
         descendants=list(_yield_descendants(cls)),
     )
+    meta.selectins = list(_yield_selectins(meta))
 
+    meta.decoder = _make_decoder(cls, meta, None)
+    meta.row_names = list(_row_positions(meta, _all_names(meta)))
+    meta.identity_decoder, meta.shared_decoder = _make_identity_decoders(
+        cls, meta, None
+    )
     cls.__repr__ = __repr__
     cls.__sqlski_meta__ = meta
     return cls
 
 
+def _with_slots(cls: type) -> type:
+    # a copy of cls with a slot per field, the slots take the place of the
+    # class attributes, so the C/Relationship of the fields are properties of
+    # the copy's own metaclass, eg. Customer.customer_id is still the C and
+    # instances read their slot as fast as any
+    names = list(cls.__dict__.get("__annotations__", {}))
+    namespace = {k: v for k, v in cls.__dict__.items() if k not in names}
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = tuple(names)
+    namespace["__getstate__"] = _getstate
+    namespace["__setstate__"] = _setstate
+    defaults = {
+        name: property(lambda _, value=cls.__dict__[name]: value)
+        for name in names
+        if name in cls.__dict__
+    }
+    metaclass = type(f"{cls.__name__}Type", (type(cls),), defaults)
+    return metaclass(cls.__name__, cls.__bases__, namespace)
+
+
+def _getstate(self) -> List[Any]:
+    # copy/pickle, which otherwise setattr the slots, failing when frozen
+    return [getattr(self, f.name) for f in fields(self)]
+
+
+def _setstate(self, state: List[Any]) -> None:
+    for f, value in zip(fields(self), state):
+        object.__setattr__(self, f.name, value)
+
+
+def _constructor(select_type: Type[Select]) -> Callable[..., Any]:
+    # takes the field values positionally, for frozen classes with slots
+    # __init__ sets them with object.__setattr__, twice as slow as setting
+    # the slots directly
+    params = select_type.__dataclass_params__
+    slotted = "__slots__" in select_type.__dict__
+    if not (params.frozen and slotted) or hasattr(select_type, "__post_init__"):
+        return select_type
+    namespace: Dict[str, Any] = {"new": object.__new__, "cls": select_type}
+    args, lines = [], []
+    for i, f in enumerate(fields(select_type)):
+        namespace[f"set_{i}"] = select_type.__dict__[f.name].__set__
+        args.append(f"_{i}")
+        lines.append(f"    set_{i}(instance, _{i})\n")
+    source = (
+        f"def make({', '.join(args)}):\n"
+        "    instance = new(cls)\n"
+        f"{''.join(lines)}"
+        "    return instance\n"
+    )
+    exec(source, namespace)
+    return namespace["make"]
+
+
 def insert(cls) -> Insert:
     cls = dataclass(cls)
 
+    column_fields = list(_yield_column_fields(cls))
+    relationships = list(_yield_insert_relationships(cls))
     meta = InsertMeta(
-        table=_get_table(cls),
-        column_fields=list(_yield_column_fields(cls)),
+        table=_get_table(column_fields),
+        column_fields=column_fields,
         returning_selects=list(_yield_returning_selects(cls)),
-        relationships=list(_yield_insert_relationships(cls)),
-        descendants=list(_yield_descendants(cls)),
+        relationships=relationships,
+        descendants=list(_yield_insert_descendants(cls, relationships)),
     )
 
     cls.__sqlski_meta__ = meta
     return cls
 
 
+def _decoder_args(
+    select_type: Type[Select],
+    meta: ResultMeta,
+    namespace: Dict[str, Any],
+    which: int,
+    extra_args: str,
+    projection: Optional[Projection],
+) -> Tuple[Dict[str, int], List[str]]:
+    loaded = _all_names(meta) if projection is None else projection[select_type]
+    positions = _row_positions(meta, loaded)
+    relationships = {r.name: r for r in meta.relationships}
+
+    args = []
+    for field in fields(select_type):
+        relationship = relationships.get(field.name)
+        if field.name not in loaded:
+            args.append("UNLOADED")
+            continue
+        if relationship is not None and relationship.strategy == SELECTIN:
+            parent_key, _ = relationship.selectin_keys
+            args.append(f"Pending(row[{positions[parent_key.name]}])")
+            continue
+        value = f"row[{positions[field.name]}]"
+        if relationship is None:
+            args.append(value)
+            continue
+        decoder_name = f"decode_{field.name}"
+        namespace[decoder_name] = decoders(relationship.type, projection)[which]
+        if relationship.is_many:
+            args.append(f"[{decoder_name}(n{extra_args}) for n in {value}]")
+        else:
+            args.append(f"{decoder_name}({value}{extra_args})")
+    return positions, args
+
+
+def row_positions(
+    select_type: Type[Select], projection: Optional[Projection] = None
+) -> Dict[str, int]:
+    # field name -> its column in the rows of to_select(...).query
+    meta = select_type.__sqlski_meta__
+    return _row_positions(meta, projection_names(select_type, projection))
+
+
+def _row_positions(meta: ResultMeta, loaded: FrozenSet[str]) -> Dict[str, int]:
+    # rows (and nested composites) have the columns in the order of
+    # column_fields then the nested relationships, see select.get_select,
+    # less any left out by the projection
+    names = [f.name for f in meta.column_fields if f.name in loaded]
+    names.extend(
+        r.name
+        for r in meta.relationships
+        if r.strategy != SELECTIN and r.name in loaded
+    )
+    return {name: i for i, name in enumerate(names)}
+
+
+def _make_decoder(
+    select_type: Type[Select], meta: ResultMeta, projection: Optional[Projection]
+) -> Callable[[Any], Any]:
+    namespace: Dict[str, Any] = {
+        "make": _constructor(select_type),
+        "Pending": Pending,
+        "UNLOADED": UNLOADED,
+    }
+    _, args = _decoder_args(select_type, meta, namespace, 0, "", projection)
+    source = f"def decode(row):\n    return make({', '.join(args)})\n"
+    exec(source, namespace)
+    return namespace["decode"]
+
+
+def _make_identity_decoders(
+    select_type: Type[Select], meta: ResultMeta, projection: Optional[Projection]
+) -> Tuple[Callable[[Any, Dict[Hashable, Any]], Any], ...]:
+    namespace: Dict[str, Any] = {
+        "cls": select_type,
+        "make": _constructor(select_type),
+        "Pending": Pending,
+        "UNLOADED": UNLOADED,
+    }
+    positions, args = _decoder_args(
+        select_type, meta, namespace, 2, ", identities", projection
+    )
+    key = "".join(f"row[{positions[c.name]}], " for c in meta.primary_key_columns)
+    # the key is looked up before decoding the row, so the nested
+    # relationships of a shared instance are only decoded once too
+    source = (
+        "def decode(row, identities):\n"
+        f"    return make({', '.join(args)})\n"
+        "def decode_shared(row, identities):\n"
+        f"    key = (cls, {key})\n"
+        "    instance = identities.get(key)\n"
+        "    if instance is None:\n"
+        "        instance = identities[key] = decode(row, identities)\n"
+        "    return instance\n"
+    )
+    exec(source, namespace)
+    return namespace["decode"], namespace["decode_shared"]
+
+
+def projection_names(
+    select_type: Type[Select], projection: Optional[Projection]
+) -> FrozenSet[str]:
+    # the names of the fields (and Ignore fields) loaded
+    if projection is None:
+        return _all_names(select_type.__sqlski_meta__)
+    return projection[select_type]
+
+
+def _all_names(meta: ResultMeta) -> FrozenSet[str]:
+    names = [f.name for f in meta.column_fields]
+    return frozenset(names + [r.name for r in meta.relationships])
+
+
+def projection_key(projection: Optional[Projection]) -> Hashable:
+    return None if projection is None else frozenset(projection.items())
+
+
+def decoders(
+    select_type: Type[Select], projection: Optional[Projection] = None
+) -> Tuple[Callable[..., Any], Callable[..., Any], Callable[..., Any]]:
+    # (decoder, identity_decoder, shared_decoder), see ResultMeta
+    meta = select_type.__sqlski_meta__
+    if projection is None:
+        return meta.decoder, meta.identity_decoder, meta.shared_decoder
+    key = projection_key(projection)
+    if key not in meta.projected_decoders:
+        meta.projected_decoders[key] = (
+            _make_decoder(select_type, meta, projection),
+            *_make_identity_decoders(select_type, meta, projection),
+        )
+    return meta.projected_decoders[key]
+
+
 def to_is_many_and_type(type_: Union[Type[R], List[Type[R]]]) -> Tuple[bool, R]:
     if not hasattr(type_, "__origin__"):
         return False, type_
@@ -195,11 +539,21 @@ def _yield_cls_column_fields(select_type: Type[Select]) -> Iterator[Field]:
             yield field
 
 
+def _inner_fields(select_type: Type[Any], name: str) -> Type[Any]:
+    # eg. the Ignore class, only a dataclass for its fields, so without the
+    # methods, and just the once
+    inner = getattr(select_type, name, None)
+    if inner is None:
+        return type(name, (), {"__dataclass_fields__": {}})
+    if "__dataclass_fields__" not in inner.__dict__:
+        inner = dataclass(inner, init=False, repr=False, eq=False)
+    return inner
+
+
 def _yield_column_fields(select_type: Type[Select]) -> Iterator[Field]:
     for field in _yield_cls_column_fields(select_type):
         yield field
-    dont_return_cls = getattr(select_type, "Ignore", type("Ignore", (), {}))
-    dont_return_cls = dataclass(dont_return_cls)
+    dont_return_cls = _inner_fields(select_type, "Ignore")
     for field in _yield_cls_column_fields(dont_return_cls):
         field.default.select_type = select_type
         yield field
@@ -221,9 +575,27 @@ def _yield_relationships(select_type: Type[Select]) -> Iterator[RelationshipBund
                 is_many=is_many,
                 join=field.default.join,
                 order_by=field.default.order_by,
+                strategy=field.default.strategy,
             )
 
 
+def _yield_selectins(
+    meta: ResultMeta,
+) -> Iterator[Tuple[Tuple[str, ...], RelationshipBundle]]:
+    for relationship in meta.relationships:
+        if relationship.strategy == SELECTIN:
+            relationship.selectin_keys  # check the join early
+            yield (), relationship
+        elif relationship.strategy is not None:
+            raise RuntimeError(
+                f"Relationship strategy must be {SELECTIN} or None, "
+                f"saw {relationship.strategy}"
+            )
+        else:
+            for path, selectin in relationship.type.__sqlski_meta__.selectins:
+                yield (relationship.name, *path), selectin
+
+
 def _yield_insert_relationships(select_type: Type[Select]) -> Iterator[InsertBundle]:
     for field in fields(select_type):
         if isinstance(field.default, InsertUsing):
@@ -236,8 +608,7 @@ def _yield_insert_relationships(select_type: Type[Select]) -> Iterator[InsertBun
             )
 
 
-def _yield_selects(select_type: Type[R]) -> Iterator[Union[Column, Operation]]:
-    column_fields = _yield_column_fields(select_type)
+def _yield_selects(column_fields: List[Field]) -> Iterator[Union[Column, Operation]]:
     for column_field in column_fields:
         column = column_field.default.column
         # we will resolve these later
@@ -250,10 +621,10 @@ def _yield_selects(select_type: Type[R]) -> Iterator[Union[Column, Operation]]:
             yield column.label(column_field.name)
 
 
-def _yield_primary_key_columns(select_type: Type[Select]) -> Iterator[C]:
+def _yield_primary_key_columns(column_fields: List[Field], table: Table) -> Iterator[C]:
     # TODO: will this work with eg. table1.a * table1.b
     columns = []
-    for field in _yield_column_fields(select_type):
+    for field in column_fields:
         if isinstance(field.default.column, Operation):
             continue
         if field.default.column.primary_key:
@@ -261,7 +632,6 @@ def _yield_primary_key_columns(select_type: Type[Select]) -> Iterator[C]:
     if not columns:
         raise RuntimeError("expect at least one primary key column to be selected")
 
-    table = _get_table(select_type)
     if {column for column in table.c if column.primary_key} != {
         c.column for c in columns
     }:
@@ -275,11 +645,20 @@ def _yield_primary_key_columns(select_type: Type[Select]) -> Iterator[C]:
 def _yield_descendants(select_type: Type[R]) -> Iterator[Type[R]]:
     yield select_type
     for relationship in _yield_relationships(select_type):
-        yield from _yield_descendants(relationship.type)
+        yield from relationship.type.__sqlski_meta__.descendants
+
+
+def _yield_insert_descendants(
+    insert_type: Type[Insert], relationships: List[InsertBundle]
+) -> Iterator[Type[Insert]]:
+    # by the InsertUsing fields, which _yield_descendants doesn't follow
+    yield insert_type
+    for relationship in relationships:
+        yield from relationship.type.__sqlski_meta__.descendants
 
 
-def _get_table(select_type: Type[Select]) -> Table:
-    columns = [field.default for field in _yield_column_fields(select_type)]
+def _get_table(column_fields: List[Field]) -> Table:
+    columns = [field.default for field in column_fields]
     referenced_tables = {
         column.column.table for column in columns if isinstance(column.column, Column)
     }
@@ -291,7 +670,6 @@ def _get_table(select_type: Type[Select]) -> Table:
 def _yield_returning_selects(
     select_type: Type[Select],
 ) -> Iterator[Union[Column, Operation]]:
-    returning_cls = getattr(select_type, "Returning", type("Returning", (), {}))
-    returning_cls = dataclass(returning_cls)
-    for column in _yield_selects(returning_cls):
+    returning_cls = _inner_fields(select_type, "Returning")
+    for column in _yield_selects(list(_yield_column_fields(returning_cls))):
         yield column
@@ -1,4 +1,7 @@
 import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
 
 
 def sub(s):
@@ -9,3 +12,19 @@ def sub(s):
         .strip()
         .split(" ")
     )
+
+
+@contextmanager
+def recorded_statements(conn, value=lambda cursor, statement: statement):
+    # value(cursor, statement) of each statement run on conn (a Connection or
+    # Engine) within the block, by default its SQL
+    values = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        values.append(value(cursor, statement))
+
+    event.listen(conn, "before_cursor_execute", record)
+    try:
+        yield values
+    finally:
+        event.remove(conn, "before_cursor_execute", record)
@@ -0,0 +1,143 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+from sqlski import (
+    UNLOADED,
+    MemoryCache,
+    async_do_inserts,
+    async_do_select,
+    do_inserts,
+    do_select,
+    func,
+    make_json_nested,
+)
+from sqlski.events import add_listener, remove_listener
+
+from .data import inserts
+from .data.selects import Basket, Customer
+from .test_insert import expected_nested_rows, nested_rows
+from .test_select import MixedCustomer, expected_customers, insert_test_data
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+async def collect(iterator):
+    return [value async for value in iterator]
+
+
+@pytest.fixture
+def async_conn(engine, conn):
+    async_conn = run(asyncpg.connect(str(engine.url)))
+    yield async_conn
+    run(async_conn.close())
+
+
+filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+
+
+def test_async_do_select(conn, async_conn):
+    insert_test_data(conn)
+    actual = run(collect(async_do_select(async_conn, Customer, filters)))
+    assert actual == expected_customers
+    # the second time round, the composite types are already registered
+    actual = run(collect(async_do_select(async_conn, Customer, filters)))
+    assert actual == expected_customers
+
+    actual = async_do_select(async_conn, Customer, filters, nesting=make_json_nested)
+    assert run(collect(actual)) == expected_customers
+
+    actual = async_do_select(async_conn, Customer, stream=True, batch_size=2)
+    assert sorted(c.customer_id for c in run(collect(actual))) == [1, 2, 3]
+
+
+def test_async_selectin(conn, async_conn):
+    insert_test_data(conn)
+    order_by = [MixedCustomer.customer_id]
+    expected = list(do_select(conn, MixedCustomer, order_by=order_by))
+    actual = async_do_select(async_conn, MixedCustomer, order_by=order_by)
+    assert run(collect(actual)) == expected
+    actual = async_do_select(async_conn, MixedCustomer, stream=True, batch_size=2)
+    assert sorted(run(collect(actual)), key=lambda c: c.customer_id) == expected
+
+    fields = ["customer_id", "baskets.purchases.product.name"]
+    expected = list(do_select(conn, MixedCustomer, order_by=order_by, fields=fields))
+    actual = async_do_select(
+        async_conn, MixedCustomer, order_by=order_by, fields=fields
+    )
+    assert run(collect(actual)) == expected
+    assert expected[0].baskets[0].purchases[0].qty is UNLOADED
+
+
+def test_async_cache(conn, async_conn):
+    insert_test_data(conn)
+    cache = MemoryCache()
+    actual = run(collect(async_do_select(async_conn, Customer, filters, cache=cache)))
+    assert actual == expected_customers
+    assert len(cache._entries) == 1
+    cached = run(collect(async_do_select(async_conn, Customer, filters, cache=cache)))
+    # copies, changing them doesn't change the cache
+    assert cached == actual and cached[0] is not actual[0]
+
+    run(async_do_inserts(async_conn, inserts.products))
+    assert cache._entries == {}
+
+    async def insert_in_transaction():
+        async with async_conn.transaction():
+            await async_do_inserts(async_conn, inserts.products)
+            assert len(cache._entries) == 1
+
+    run(collect(async_do_select(async_conn, Customer, filters, cache=cache)))
+    run(insert_in_transaction())
+    assert cache._entries == {}
+
+
+def test_async_do_inserts(conn, async_conn):
+    do_inserts(conn, inserts.products)
+    returning = run(async_do_inserts(async_conn, inserts.customers, chunk_size=2))
+    assert [r["customer_id"] for r in returning] == [1, 2, 3]
+    assert nested_rows(conn) == expected_nested_rows
+
+
+def test_async_do_inserts_without_returning(conn, async_conn):
+    do_inserts(conn, inserts.products)
+    customers = (customer for customer in inserts.customers)
+    returning = async_do_inserts(async_conn, customers, chunk_size=2, returning=False)
+    assert run(returning) == []
+    assert nested_rows(conn) == expected_nested_rows
+
+
+def test_async_do_inserts_single_statement(conn, async_conn):
+    do_inserts(conn, inserts.products)
+    returning = async_do_inserts(async_conn, inserts.customers, single_statement=True)
+    assert [r["customer_id"] for r in run(returning)] == [1, 2, 3]
+    assert nested_rows(conn) == expected_nested_rows
+
+
+def test_async_stream_error_rolls_back(conn, async_conn):
+    insert_test_data(conn)
+    filters = [func.textregexeq(Customer.aliased_username, "(")]
+    actual = async_do_select(async_conn, Customer, filters, stream=True)
+    with pytest.raises(asyncpg.InvalidRegularExpressionError):
+        run(collect(actual))
+    assert not async_conn.is_in_transaction()
+    actual = async_do_select(async_conn, Customer, stream=True, batch_size=2)
+    assert len(run(collect(actual))) == 3
+
+
+def test_async_do_inserts_events(conn, async_conn):
+    do_inserts(conn, inserts.products)
+    events = []
+    add_listener(events.append)
+    try:
+        run(async_do_inserts(async_conn, inserts.customers))
+    finally:
+        remove_listener(events.append)
+    assert [(e.type, e.rows) for e in events if e.phase == "insert"] == [
+        (inserts.Customer, 3),
+        (inserts.Basket, 4),
+        (inserts.Purchase, 5),
+    ]
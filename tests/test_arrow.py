@@ -0,0 +1,44 @@
+from dataclasses import asdict
+
+import pytest
+
+from sqlski import do_select, make_json_nested
+
+from .data.selects import Basket, Customer
+from .test_select import MixedCustomer, insert_test_data
+
+pa = pytest.importorskip("pyarrow")
+from sqlski.arrow import to_arrow  # noqa: E402
+
+order_by = [Customer.customer_id]
+
+
+def test_to_arrow(conn):
+    insert_test_data(conn)
+    expected = [asdict(c) for c in do_select(conn, Customer, order_by=order_by)]
+    table = to_arrow(conn, Customer, order_by=order_by)
+    assert table.to_pylist() == expected
+    assert table.schema.field("customer_id").type == pa.int64()
+    baskets = table.schema.field("baskets").type
+    assert pa.types.is_list(baskets) and pa.types.is_struct(baskets.value_type)
+
+    table = to_arrow(conn, Customer, order_by=order_by, nesting=make_json_nested)
+    assert table.to_pylist() == expected
+
+    table = to_arrow(conn, Customer, [Basket.basket_id == 7], order_by=order_by)
+    assert table.column("baskets").to_pylist() == [[], [], []]
+
+
+def test_to_arrow_projection(conn):
+    insert_test_data(conn)
+    fields = ["customer_id", "baskets.basket_id"]
+    table = to_arrow(conn, Customer, order_by=order_by, fields=fields)
+    assert table.to_pylist() == [
+        {"customer_id": 1, "baskets": [{"basket_id": 1}, {"basket_id": 2}]},
+        {"customer_id": 2, "baskets": []},
+        {"customer_id": 3, "baskets": [{"basket_id": 3}, {"basket_id": 4}]},
+    ]
+    assert table.column_names == ["customer_id", "baskets"]
+
+    with pytest.raises(RuntimeError):
+        to_arrow(conn, MixedCustomer)
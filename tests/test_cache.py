@@ -0,0 +1,108 @@
+from datetime import date
+
+from sqlski import MemoryCache, do_inserts, do_select, invalidate_tables
+from sqlski.cache import time
+
+from .data import inserts
+from .data.selects import Basket, Customer, Product, Purchase
+from .helpers import recorded_statements
+from .test_select import insert_test_data
+
+
+def test_memory_cache_evicts(monkeypatch):
+    cache = MemoryCache(max_size=2, ttl=10)
+    cache.set("a", [1], frozenset(["product"]))
+    cache.set("b", [2], frozenset(["customer", "basket"]))
+    assert cache.get("a") == [1]
+    cache.set("c", [3], frozenset(["customer"]))
+    # b was the least recently used
+    assert [cache.get(k) for k in "abc"] == [[1], None, [3]]
+
+    cache.invalidate(["customer"])
+    assert [cache.get(k) for k in "abc"] == [[1], None, None]
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert cache._entries == {} and cache._keys_by_table == {}
+
+
+def selects(statements):
+    # not the lookups of the composite types
+    return [s for s in statements if s.lstrip().startswith("SELECT") and "pg_" not in s]
+
+
+def test_do_select_cached(conn):
+    insert_test_data(conn)
+    with recorded_statements(conn) as statements:
+        cache = MemoryCache()
+        filters = [Product.price_cents == 90]
+        [apple] = do_select(conn, Product, filters, cache=cache)
+        assert list(do_select(conn, Product, filters, cache=cache)) == [apple]
+        assert len(selects(statements)) == 1
+        # other values are other entries
+        [ham] = do_select(conn, Product, [Product.price_cents == 400], cache=cache)
+        assert ham.name == "ham" and len(selects(statements)) == 2
+
+        customers = list(do_select(conn, Customer, cache=cache))
+        assert len(selects(statements)) == 3
+        # writing to a table of a select forgets it, Customer reads product too
+        do_inserts(conn, inserts.Product(name="pear", price_cents=90))
+        [apple, pear] = do_select(conn, Product, filters, cache=cache)
+        assert pear.name == "pear" and len(selects(statements)) == 4
+        assert list(do_select(conn, Customer, cache=cache)) == customers
+        assert len(selects(statements)) == 5
+
+        invalidate_tables(["customer"])
+        assert list(do_select(conn, Customer, cache=cache)) == customers
+        do_select(conn, Product, filters, cache=cache)
+        assert len(selects(statements)) == 6
+
+
+def test_nested_inserts_invalidate_child_tables(conn):
+    insert_test_data(conn)
+    cache = MemoryCache()
+    assert len(list(do_select(conn, Basket, cache=cache))) == 4
+    assert len(list(do_select(conn, Purchase, cache=cache))) == 5
+    purchase = inserts.Purchase(product_id=1, qty=2)
+    basket = inserts.Basket(aliased_created_date=date(2017, 1, 8), purchases=[purchase])
+    customer = inserts.Customer(
+        username="ginny", postcode="OX12AB", dob=date(1991, 8, 11), baskets=[basket]
+    )
+    do_inserts(conn, customer)
+    assert len(list(do_select(conn, Basket, cache=cache))) == 5
+    assert len(list(do_select(conn, Purchase, cache=cache))) == 6
+
+
+def test_cache_returns_copies(conn):
+    insert_test_data(conn)
+    cache = MemoryCache()
+    [apple] = do_select(conn, Product, [Product.price_cents == 90], cache=cache)
+    apple.name = "pear"
+    [apple] = do_select(conn, Product, [Product.price_cents == 90], cache=cache)
+    apple.name = "pear"
+    [apple] = do_select(conn, Product, [Product.price_cents == 90], cache=cache)
+    assert apple.name == "apple"
+
+
+def test_inserts_invalidate_on_commit(conn, engine):
+    insert_test_data(conn)
+    cache = MemoryCache()
+    filters = [Product.price_cents == 90]
+    other = engine.connect()
+    assert len(list(do_select(other, Product, filters, cache=cache))) == 1
+    with conn.begin():
+        do_inserts(conn, inserts.Product(name="pear", price_cents=90))
+        # other selects would cache the rows from before the insert again
+        assert len(list(do_select(other, Product, filters, cache=cache))) == 1
+        assert len(cache._entries) == 1
+    assert len(list(do_select(other, Product, filters, cache=cache))) == 2
+
+    # on rollback too, selects in the transaction may have cached its writes
+    trans = conn.begin()
+    do_inserts(conn, inserts.Product(name="plum", price_cents=90))
+    cache.clear()
+    assert len(list(do_select(conn, Product, filters, cache=cache))) == 3
+    trans.rollback()
+    assert len(list(do_select(other, Product, filters, cache=cache))) == 2
+    other.close()
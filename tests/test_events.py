@@ -0,0 +1,70 @@
+from sqlski import do_inserts, do_select, make_json_nested
+from sqlski.composite import clear_registered_composites
+from sqlski.events import Timings, add_listener, remove_listener
+
+from .data import inserts
+from .data.selects import Basket, Customer
+from .test_select import SelectInCustomer, insert_test_data
+
+
+def test_select_phases(conn):
+    insert_test_data(conn)
+    clear_registered_composites(conn)
+    Customer.__sqlski_meta__.prepared_selects.clear()
+    with Timings() as timings:
+        customers = list(do_select(conn, Customer))
+    assert list(timings.phases) == [
+        "build",
+        "create_type",
+        "catalog",
+        "compile",
+        "execute",
+        "decode",
+    ]
+    assert timings.phases["create_type"].count == 3
+    assert timings.phases["execute"].rows == 3
+    assert timings.phases["decode"].rows == 3
+    assert list(timings.types[Customer]) == ["build", "compile", "execute", "decode"]
+    baskets = [b for c in customers for b in c.baskets]
+    purchases = [p for b in baskets for p in b.purchases]
+    assert timings.relationship_rows == {
+        "baskets": len(baskets),
+        "purchases": len(purchases),
+        "product": len(purchases),
+    }
+    # the baskets' text includes their purchases' and so on
+    bytes_ = timings.relationship_bytes
+    assert bytes_["baskets"] > bytes_["purchases"] > bytes_["product"] > 0
+    # a row per phase and relationship
+    report = [line.split() for line in timings.report().splitlines()]
+    assert report[0] == ["phase", "count", "rows", "secs"]
+    assert report[5][:3] == ["execute", "1", "3"]
+    assert report[7] == ["relationship", "rows", "bytes"]
+    assert report[8] == ["baskets", str(len(baskets)), str(bytes_["baskets"])]
+
+    # already built, compiled and registered
+    with Timings() as timings:
+        list(do_select(conn, Customer, nesting=make_json_nested))
+        list(do_select(conn, Customer))
+    assert list(timings.phases) == ["build", "compile", "execute", "decode"]
+    assert timings.phases["execute"].count == 2
+    assert timings.relationship_bytes.keys() == {"baskets", "purchases", "product"}
+
+
+def test_selectin_and_insert_phases(conn):
+    events = []
+    add_listener(events.append)
+    try:
+        do_inserts(conn, inserts.products)
+        do_inserts(conn, inserts.customers)
+        list(do_select(conn, SelectInCustomer))
+    finally:
+        remove_listener(events.append)
+    assert [(e.type, e.rows) for e in events if e.phase == "insert"] == [
+        (inserts.Product, 3),
+        (inserts.Customer, 3),
+        (inserts.Basket, 4),
+        (inserts.Purchase, 5),
+    ]
+    decodes = [(e.type, e.rows) for e in events if e.phase == "decode"]
+    assert decodes == [(SelectInCustomer, 3), (Basket, 4)]
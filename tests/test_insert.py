@@ -1,16 +1,21 @@
 import datetime
+import enum
 import re
 from pathlib import Path
+from typing import Any, List
 
-from sqlski import from_row, sqlformat, to_inserts, do_inserts
+import pytest
+from sqlalchemy import Column, Enum, Integer, MetaData, String, Table
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+from sqlski import C, from_row, insert, sqlformat, to_inserts, do_inserts
 
 from .data import model
 from .data.inserts import customers, products, Customer, Basket, Purchase, Product
-from .helpers import sub
+from .helpers import recorded_statements, sub
 
 
 # TODO:
-# - unnest example
 # - no more session - assign to update .append etc
 
 
@@ -159,3 +164,160 @@ def test_helpers(conn):
     assert product_ids == [1, 2, 3]
     customer_ids = [r.customer_id for r in do_inserts(conn, customers)]
     assert customer_ids == [1, 2, 3]
+
+
+def nested_rows(conn):
+    rows = conn.execute(
+        "SELECT c.username, b.created_date, p.product_id, p.qty "
+        "FROM customer c "
+        "JOIN basket b USING (customer_id) "
+        "LEFT JOIN purchase p USING (basket_id) "
+        "ORDER BY c.customer_id, b.basket_id, p.purchase_id"
+    )
+    return [tuple(r) for r in rows]
+
+
+expected_nested_rows = [
+    ("oliver", datetime.date(2017, 1, 3), 1, 3),
+    ("oliver", datetime.date(2017, 1, 3), 3, 1),
+    ("oliver", datetime.date(2017, 1, 4), 2, 2),
+    ("harry", datetime.date(2017, 1, 7), 3, 4),
+    ("harry", datetime.date(2017, 1, 7), 2, 1),
+    ("harry", datetime.date(2017, 1, 8), None, None),
+]
+
+
+def test_single_statement(conn):
+    do_inserts(conn, products)
+    with recorded_statements(conn) as statements:
+        returning = do_inserts(conn, customers, single_statement=True)
+    assert [r.customer_id for r in returning] == [1, 2, 3]
+    assert len(statements) == 1
+
+    assert nested_rows(conn) == expected_nested_rows
+
+
+@insert
+class ProductName:
+    name: str = C(model.product.c.name)
+    price_cents: int = C(model.product.c.price_cents)
+
+
+def test_copy_leaf_layers(conn):
+    do_inserts(conn, products)
+    querys = to_inserts(customers, copy=True)
+    assert [r.customer_id for r in next(querys)(conn)] == [1, 2, 3]
+    assert [r.basket_id for r in next(querys)(conn)] == [1, 2, 3, 4]
+    third = next(querys)
+    assert str(third.query) == "COPY purchase (product_id, qty, basket_id) FROM STDIN"
+    third(conn)
+    rows = conn.execute("SELECT basket_id, product_id, qty FROM purchase ORDER BY 1, 2")
+    assert [tuple(r) for r in rows] == [
+        (1, 1, 3),
+        (1, 3, 1),
+        (2, 2, 2),
+        (3, 2, 1),
+        (3, 3, 4),
+    ]
+
+    names = ["tab\tnew\nline", "back\\slash", "\\N"]
+    do_inserts(conn, [ProductName(name=n, price_cents=1) for n in names], copy=True)
+    rows = conn.execute("SELECT name FROM product WHERE product_id > 3 ORDER BY 1")
+    assert [r.name for r in rows] == sorted(names)
+
+
+class Color(enum.Enum):
+    red = 1
+    green = 2
+
+
+copy_types = Table(
+    "copy_types",
+    MetaData(),
+    Column("copy_types_id", Integer, primary_key=True),
+    Column("color", Enum(Color)),
+    Column("data", JSONB),
+    Column("tags", ARRAY(String)),
+)
+
+
+@insert
+class CopyTypes:
+    color: Color = C(copy_types.c.color)
+    data: Any = C(copy_types.c.data)
+
+
+@insert
+class CopyTags:
+    tags: List[str] = C(copy_types.c.tags)
+
+
+def test_copy_binds_like_insert(conn):
+    copy_types.create(conn)
+    try:
+        values = [(Color.red, "text"), (Color.green, [1, {"a": None}]), (None, None)]
+        rows = [CopyTypes(color=c, data=d) for c, d in values]
+        do_inserts(conn, rows)
+        do_inserts(conn, rows, copy=True)
+        query = "SELECT color, data FROM copy_types ORDER BY copy_types_id"
+        copied = [tuple(r) for r in conn.execute(query)]
+        assert (
+            copied[:3]
+            == copied[3:]
+            == [
+                ("red", "text"),
+                ("green", [1, {"a": None}]),
+                (None, None),
+            ]
+        )
+        with pytest.raises(RuntimeError):
+            do_inserts(conn, [CopyTags(tags=["a"])], copy=True)
+    finally:
+        copy_types.drop(conn)
+
+
+def test_unnest(conn):
+    do_inserts(conn, products)
+    querys = to_inserts(customers[:1], unnest=True)
+    expected = """
+INSERT INTO customer (username, postcode, dob)
+SELECT _values.username, _values.postcode, _values.dob
+FROM (
+    SELECT * FROM unnest(
+        CAST(ARRAY['oliver'] AS VARCHAR[]),
+        CAST(ARRAY['SL95GH'] AS VARCHAR[]),
+        CAST(ARRAY['1990-01-20'] AS DATE[])
+    ) WITH ORDINALITY AS _v(username, postcode, dob, _ord)
+) AS _values
+ORDER BY _values._ord
+RETURNING customer.customer_id
+"""
+    first = next(querys)
+    assert sub(sqlformat(first.query)) == sub(expected)
+
+    # the SQL doesn't change with the number of rows
+    many = next(to_inserts(customers, unnest=True))
+    assert str(many.query.compile(dialect=conn.dialect)) == str(
+        first.query.compile(dialect=conn.dialect)
+    )
+
+    returning = do_inserts(conn, customers, unnest=True)
+    assert [r.customer_id for r in returning] == [1, 2, 3]
+    assert nested_rows(conn) == expected_nested_rows
+
+
+def test_chunked_generator(conn):
+    do_inserts(conn, products)
+    inserts = (customer for customer in customers)
+    with recorded_statements(conn) as statements:
+        returning = do_inserts(conn, inserts, chunk_size=2)
+    assert [r.customer_id for r in returning] == [1, 2, 3]
+    assert len(statements) == 6  # 2 chunks * 3 layers
+    assert nested_rows(conn) == expected_nested_rows
+
+
+def test_chunked_without_returning(conn):
+    do_inserts(conn, products)
+    inserts = (customer for customer in customers)
+    assert do_inserts(conn, inserts, chunk_size=2, returning=False) == []
+    assert nested_rows(conn) == expected_nested_rows
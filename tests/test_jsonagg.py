@@ -0,0 +1,49 @@
+import datetime
+import json
+from decimal import Decimal
+from uuid import UUID
+
+from sqlalchemy import Column, Date, DateTime, Float, Integer, Numeric, String
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+
+from sqlski.jsonagg import JsonType
+
+
+def test_decode_typed_values():
+    child = JsonType("_type_children", [Column("n", Integer)], many=True)
+    json_type = JsonType(
+        "_type_parent",
+        [
+            Column("name", String),
+            Column("created", Date),
+            Column("updated", DateTime),
+            Column("price", Numeric),
+            Column("ratio", Float),
+            Column("uuid", PG_UUID(as_uuid=True)),
+            Column("children", child),
+        ],
+    )
+    value = {
+        "name": "harry",
+        "created": "2017-01-07",
+        "updated": "2017-01-07T10:11:12.5",
+        "price": 12.10,
+        "ratio": 0.5,
+        "uuid": "c9d2a3c4-5a5e-4a6e-9c1e-8c1a4f3f2b10",
+        "children": [{"n": 1}, {"n": 2}],
+    }
+    process = json_type.result_processor(None, None)
+    actual = process(json.dumps(value))
+    assert actual == (
+        "harry",
+        datetime.date(2017, 1, 7),
+        datetime.datetime(2017, 1, 7, 10, 11, 12, 500000),
+        Decimal("12.1"),
+        0.5,
+        UUID("c9d2a3c4-5a5e-4a6e-9c1e-8c1a4f3f2b10"),
+        [(1,), (2,)],
+    )
+    assert isinstance(actual.price, Decimal)
+    assert isinstance(actual.ratio, float)
+    assert actual.children[1].n == 2
+    assert process(None) is None
@@ -1,13 +1,38 @@
 import datetime
-from dataclasses import asdict
+import pickle
+from copy import deepcopy
+from dataclasses import FrozenInstanceError, asdict
 from pathlib import Path
+from typing import List
 
-from sqlski import from_row, sqlformat, to_select, do_select, do_inserts
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy import select as sa_select
+
+from sqlski import (
+    UNLOADED,
+    C,
+    Relationship,
+    func,
+    select,
+    from_row,
+    sqlformat,
+    to_select,
+    do_select,
+    do_inserts,
+    prepare_select,
+    make_json_nested,
+    make_nested,
+    install_types,
+    make_installed_nested,
+)
+from sqlski.composite import clear_registered_composites, forget_installed
 
 from .data import model
+from .data.model import basket, customer, product, purchase
 from .data.selects import Basket, Customer, Product, Purchase
 from .data.inserts import products, customers
-from .helpers import sub
+from .helpers import recorded_statements, sub
 
 
 def insert_test_data(conn):
@@ -32,6 +57,11 @@ FROM product
     ]
     assert actual == expected
 
+    # rows of other queries are read by column name
+    query = sa_select([product.c.price_cents, product.c.name, product.c.product_id])
+    row = conn.execute(query.order_by(product.c.product_id)).first()
+    assert from_row(Product, row) == expected[0]
+
 
 def test_basic_filter(conn):
     insert_test_data(conn)
@@ -140,6 +170,52 @@ def test_two_levels_nested(conn):
     assert [asdict(n) for n in actual] == expected
 
 
+def test_only_table_filters_pushed_down(conn):
+    insert_test_data(conn)
+    created_date = datetime.date(2017, 1, 7)
+    filters = [Basket.total_price_cents == 1690, Basket.created_date == created_date]
+    sql = sub(sqlformat(to_select(Basket, filters=filters).query))
+    pushed = ["WHERE", "basket.created_date", "=", "'2017-01-07'"]
+    where = sql.index("WHERE")
+    assert sql[where : where + 4] == pushed
+    assert sql[-4:] == ["WHERE", "_sub_basket.total_price_cents", "=", "1690"]
+    [actual] = do_select(conn, Basket, filters=filters)
+    assert actual.basket_id == 3
+
+
+@select
+class CustomerRows:
+    customer_id: int = C(customer.c.customer_id)
+    # an aggregate of just the table's columns, one per joined basket
+    rows: int = C(func.count(customer.c.customer_id))
+    baskets: List[Basket] = Relationship(customer_id == Basket.Ignore.customer_id)
+
+
+def test_aggregate_filters_not_pushed_down(conn):
+    insert_test_data(conn)
+    filters = [CustomerRows.rows == 2]
+    sql = sub(sqlformat(to_select(CustomerRows, filters=filters).query))
+    assert sql[-4:] == ["WHERE", "_sub_customerrows.rows", "=", "2"]
+    expected = [c.customer_id for c in do_select(conn, Customer) if len(c.baskets) == 2]
+    actual = do_select(conn, CustomerRows, filters=filters)
+    assert [c.customer_id for c in actual] == expected
+
+
+def test_relationship_filters_pushed_down(conn):
+    insert_test_data(conn)
+    filters = [Purchase.qty == 4, Basket.total_price_cents == 1600]
+    sql = sqlformat(to_select(Customer, filters=filters).query)
+    # into the purchase subquery, the computed total stays in the ON clause
+    assert "WHERE purchase.qty = 4" in sql
+    assert "AND _sub_basket.total_price_cents = 1600" in sql
+    for strategy in ["group_by", "lateral"]:
+        actual = do_select(conn, Customer, filters, strategy=strategy)
+        baskets = {c.customer_id: c.baskets for c in actual}
+        assert [b.basket_id for b in baskets[3]] == [3]
+        assert [p.qty for p in baskets[3][0].purchases] == [4]
+        assert baskets[1] == baskets[2] == []
+
+
 def test_two_levels_with_helper(conn):
     insert_test_data(conn)
     actual = do_select(
@@ -152,3 +228,544 @@ def test_two_levels_with_helper(conn):
     )
     actual = list(actual)
     assert actual == expected_customers
+
+
+def test_composite_types_registered_once_per_connection(conn):
+    insert_test_data(conn)
+    clear_registered_composites(conn)
+    with recorded_statements(conn) as statements:
+        assert len(list(do_select(conn, Customer))) == 3
+    assert len(statements) == 7  # 3 * (CREATE TYPE + catalog lookup) + SELECT
+    with recorded_statements(conn) as statements:
+        assert len(list(do_select(conn, Customer))) == 3
+    assert len(statements) == 1
+
+
+def test_composite_types_reregistered_after_rollback(conn):
+    insert_test_data(conn)
+    conn.invalidate()  # start with a fresh session without any temporary types
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    trans = conn.begin()
+    assert list(do_select(conn, Customer, filters=filters)) == expected_customers
+    trans.rollback()
+    assert list(do_select(conn, Customer, filters=filters)) == expected_customers
+
+
+def test_composite_types_of_other_sessions_ignored(conn, engine):
+    insert_test_data(conn)
+    other = engine.connect()
+    assert len(list(do_select(other, Customer))) == 3
+    conn.invalidate()
+    assert len(list(do_select(conn, Customer))) == 3
+    other.close()
+
+
+def test_installed_types(conn, engine):
+    insert_test_data(conn)
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    assert len(install_types(engine, [Customer, MixedCustomer])) > 0
+    try:
+        assert install_types(engine, [Customer]) == []
+        with recorded_statements(engine) as statements:
+            actual = do_select(conn, Customer, filters, nesting=make_installed_nested)
+            assert list(actual) == expected_customers
+        # the catalog is read once per process, then no DDL or lookups at all
+        assert len(statements) == 2
+        with recorded_statements(engine) as statements:
+            other = engine.connect()
+            actual = do_select(other, Customer, filters, nesting=make_installed_nested)
+            assert list(actual) == expected_customers
+            other.close()
+        assert len(statements) == 1 and "sqlski._type_baskets_" in statements[0]
+
+        order_by = [MixedCustomer.customer_id]
+        expected = list(do_select(conn, MixedCustomer, order_by=order_by))
+        actual = do_select(
+            conn, MixedCustomer, order_by=order_by, nesting=make_installed_nested
+        )
+        assert list(actual) == expected
+    finally:
+        conn.execute("DROP SCHEMA sqlski CASCADE")
+        forget_installed()
+
+
+@select
+class PurchaseQty:
+    class Ignore:
+        basket_id: int = C(purchase.c.basket_id)
+
+    purchase_id: int = C(purchase.c.purchase_id)
+    qty: int = C(purchase.c.qty)
+
+
+@select
+class BasketQtys:
+    basket_id: int = C(basket.c.basket_id)
+    purchases: List[PurchaseQty] = Relationship(
+        basket_id == PurchaseQty.Ignore.basket_id
+    )
+
+
+def test_composite_types_using_a_recreated_type_are_recreated(conn):
+    insert_test_data(conn)
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    assert list(do_select(conn, Customer, filters)) == expected_customers
+    assert len(list(do_select(conn, BasketQtys))) == 4
+    # leaves _type_product, which isn't used by BasketQtys, unregistered
+    assert list(do_select(conn, Customer, filters)) == expected_customers
+    # so this recreates it, dropping the product attribute of _type_purchases
+    [basket] = do_select(conn, Basket, [Basket.basket_id == 3])
+    assert basket == expected_customers[0].baskets[0]
+
+
+def test_prepared_select_reused_for_same_filter_shape(conn):
+    insert_test_data(conn)
+    harry, params = prepare_select(Customer, [Customer.upper_cased_username == "HARRY"])
+    assert params == {"_filter_0": "HARRY"}
+    tom, params = prepare_select(Customer, [Customer.upper_cased_username == "TOM"])
+    assert params == {"_filter_0": "TOM"}
+    assert harry is tom
+    other, _ = prepare_select(Customer, [Customer.customer_id == 1])
+    assert other is not harry
+
+    [actual] = do_select(conn, Customer, [Customer.upper_cased_username == "TOM"])
+    assert (actual.customer_id, actual.baskets) == (2, [])
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    assert list(do_select(conn, Customer, filters)) == expected_customers
+    assert list(do_select(conn, Customer, filters)) == expected_customers
+    prepared, _ = prepare_select(Customer, filters)
+    assert len(prepared.compiled_cache) == 1
+
+
+def test_streaming_uses_server_side_cursor(conn):
+    insert_test_data(conn)
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    with recorded_statements(conn, lambda cursor, _: cursor.name) as cursor_names:
+        actual = do_select(conn, Customer, filters, stream=True, batch_size=1)
+        assert list(actual) == expected_customers
+    assert cursor_names[-1] is not None
+
+    actual = do_select(conn, Customer, stream=True, batch_size=2)
+    assert sorted(c.customer_id for c in actual) == [1, 2, 3]
+
+
+def test_server_prepared_statements(conn, engine):
+    insert_test_data(conn)
+    # start with a fresh session without any statements, not one of the pool's
+    engine.dispose()
+    conn.invalidate()
+    prepared = conn.execution_options(sqlski_prepare=True)
+
+    def commands(statements):
+        return [statement.split()[0] for statement in statements]
+
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    with recorded_statements(conn) as statements:
+        assert list(do_select(prepared, Customer, filters)) == expected_customers
+    assert commands(statements)[-2:] == ["PREPARE", "EXECUTE"]
+    tom = [Customer.upper_cased_username == "TOM"]
+    with recorded_statements(conn) as statements:
+        [actual] = do_select(prepared, Customer, tom)
+        assert (actual.customer_id, actual.baskets) == (2, [])
+        [actual] = do_select(prepared, Customer, tom)
+    assert commands(statements) == ["PREPARE", "EXECUTE", "EXECUTE"]
+
+    # recreating _type_purchases invalidates the statements using it
+    assert len(list(do_select(prepared, BasketQtys))) == 4
+    with recorded_statements(conn) as statements:
+        assert list(do_select(prepared, Customer, filters)) == expected_customers
+    assert commands(statements)[-3:] == ["DEALLOCATE", "PREPARE", "EXECUTE"]
+
+    # a rollback drops the types created in the transaction, not the statement
+    engine.dispose()
+    prepared.invalidate()
+    trans = prepared.begin()
+    assert list(do_select(prepared, Customer, filters)) == expected_customers
+    trans.rollback()
+    with recorded_statements(conn) as statements:
+        assert list(do_select(prepared, Customer, filters)) == expected_customers
+    assert commands(statements)[-3:] == ["DEALLOCATE", "PREPARE", "EXECUTE"]
+
+
+def test_json_nesting(conn):
+    insert_test_data(conn)
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    with recorded_statements(conn) as statements:
+        actual = do_select(conn, Customer, filters, nesting=make_json_nested)
+        assert list(actual) == expected_customers
+    assert len(statements) == 1
+    assert "json_agg(json_build_object('basket_id'," in statements[0]
+
+    actual = do_select(conn, Customer, nesting=make_json_nested)
+    actual = sorted(actual, key=lambda c: c.customer_id)
+    assert [len(c.baskets) for c in actual] == [2, 0, 2]
+
+
+@select
+class OrderedCustomer:
+    customer_id: int = C(customer.c.customer_id)
+    baskets: List[Basket] = Relationship(
+        customer_id == Basket.Ignore.customer_id,
+        order_by=[Basket.basket_id.desc()],
+    )
+
+
+def test_relationship_order_by(conn):
+    insert_test_data(conn)
+    order_by = [OrderedCustomer.customer_id]
+    for nesting in [make_nested, make_json_nested]:
+        actual = do_select(conn, OrderedCustomer, order_by=order_by, nesting=nesting)
+        actual = [[b.basket_id for b in c.baskets] for c in actual]
+        assert actual == [[2, 1], [], [4, 3]]
+
+
+def test_limit_applied_before_nesting(conn):
+    insert_test_data(conn)
+    order_by = [Customer.customer_id.desc()]
+    extras = to_select(Customer, order_by=order_by, limit=2)
+    assert "LIMIT 2) AS _page_customer" in sqlformat(extras.query)
+
+    page = do_select(conn, Customer, order_by=order_by, limit=2)
+    assert [c.customer_id for c in page] == [3, 2]
+    page = do_select(conn, Customer, order_by=order_by, limit=2, after=[2])
+    assert [c.customer_id for c in page] == [1]
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    page = do_select(conn, Customer, filters, order_by=order_by, limit=1)
+    assert list(page) == expected_customers
+
+    # the INNER JOINed product's filter drops rows, so it's paged after it
+    filters = [Product.name == "ham"]
+    order_by = [Purchase.qty.desc()]
+    assert "_page_purchase" not in sqlformat(
+        to_select(Purchase, filters, order_by=order_by, limit=2).query
+    )
+    for strategy in ["group_by", "lateral"]:
+        page = do_select(
+            conn, Purchase, filters, order_by=order_by, limit=2, strategy=strategy
+        )
+        assert [(p.qty, p.product.name) for p in page] == [(4, "ham"), (1, "ham")]
+
+    # a NOT NULL foreign key joins every purchase to its product
+    order_by = [Purchase.Ignore.purchase_id]
+    assert "_page_purchase" in sqlformat(
+        to_select(Purchase, order_by=order_by, limit=2).query
+    )
+    order_by = [PurchaseOfQty.qty.desc(), PurchaseOfQty.purchase_id]
+    expected = list(do_select(conn, PurchaseOfQty, order_by=order_by))[:2]
+    assert "_page_" not in sqlformat(
+        to_select(PurchaseOfQty, order_by=order_by, limit=2).query
+    )
+    page = do_select(conn, PurchaseOfQty, order_by=order_by, limit=2)
+    assert list(page) == expected and [p.qty for p in expected] == [3, 2]
+
+
+@select
+class PurchaseOfQty:
+    purchase_id: int = C(purchase.c.purchase_id)
+    qty: int = C(purchase.c.qty)
+    # not a foreign key, the purchases without a product of their qty's id
+    # are dropped
+    product: Product = Relationship(qty == Product.product_id)
+
+
+note = Table(
+    "note",
+    MetaData(),
+    Column("note_id", Integer, primary_key=True),
+    Column("text", String),
+)
+
+
+@select
+class Note:
+    note_id: int = C(note.c.note_id)
+    text: str = C(note.c.text)
+
+
+def test_after_refuses_nullable_order_by():
+    with pytest.raises(RuntimeError, match="nullable text"):
+        to_select(Note, order_by=[Note.text], limit=1, after=["a"])
+    to_select(Note, order_by=[Note.note_id], limit=1, after=[1])
+
+
+def test_order_by_relationship_value(conn):
+    insert_test_data(conn)
+    order_by = [Basket.total_price_cents, Basket.basket_id.desc()]
+    extras = to_select(Basket, order_by=order_by, limit=2)
+    assert "_page_basket" not in sqlformat(extras.query)
+
+    def key(b):
+        # Postgres sorts NULLs last
+        return (b.total_price_cents is None, b.total_price_cents or 0, -b.basket_id)
+
+    expected = sorted(do_select(conn, Basket), key=key)
+    page = list(do_select(conn, Basket, order_by=order_by, limit=2))
+    assert page == expected[:2]
+    after = [page[-1].total_price_cents, page[-1].basket_id]
+    page = do_select(conn, Basket, order_by=order_by, limit=1, after=after)
+    assert list(page) == expected[2:3]
+
+
+def unordered(customers):
+    # relationships without an order_by come back in any order
+    customers = deepcopy(customers)
+    for customer in customers:
+        for basket in customer.baskets:
+            basket.purchases.sort(key=lambda p: (p.product.product_id, p.qty))
+        customer.baskets.sort(key=lambda b: b.basket_id)
+    return sorted(customers, key=lambda c: c.customer_id)
+
+
+def test_lateral_strategy(conn):
+    insert_test_data(conn)
+    extras = to_select(Customer, strategy="lateral")
+    sql = sqlformat(extras.query)
+    assert "LEFT OUTER JOIN LATERAL" in sql
+    assert "GROUP BY" not in sql
+
+    filters = [Customer.upper_cased_username == "HARRY", Basket.basket_id == 3]
+    for nesting in [make_nested, make_json_nested]:
+        actual = do_select(conn, Customer, filters, nesting=nesting, strategy="lateral")
+        assert unordered(list(actual)) == unordered(expected_customers)
+    order_by = [Customer.customer_id]
+    expected = unordered(list(do_select(conn, Customer, order_by=order_by)))
+    actual = do_select(conn, Customer, order_by=order_by, strategy="lateral")
+    assert unordered(list(actual)) == expected
+    order_by = [Basket.total_price_cents, Basket.basket_id]
+    expected = list(do_select(conn, Basket, order_by=order_by, limit=3))
+    actual = do_select(conn, Basket, order_by=order_by, limit=3, strategy="lateral")
+    assert [(b.basket_id, b.total_price_cents) for b in actual] == [
+        (b.basket_id, b.total_price_cents) for b in expected
+    ]
+
+
+@select
+class BasketWeightedQty:
+    basket_id: int = C(basket.c.basket_id)
+    # an aggregate of a nested operation
+    weighted_qty: int = C(func.sum(PurchaseQty.qty * PurchaseQty.purchase_id))
+    purchases: List[PurchaseQty] = Relationship(
+        basket_id == PurchaseQty.Ignore.basket_id
+    )
+
+
+def test_nested_operations(conn):
+    insert_test_data(conn)
+    order_by = [BasketWeightedQty.basket_id]
+    for strategy in ["group_by", "lateral"]:
+        actual = do_select(
+            conn, BasketWeightedQty, order_by=order_by, strategy=strategy
+        )
+        for basket in actual:
+            expected = sum(p.qty * p.purchase_id for p in basket.purchases)
+            assert basket.weighted_qty == (expected if basket.purchases else None)
+
+
+@select
+class SelectInCustomer:
+    customer_id: int = C(customer.c.customer_id)
+    aliased_username: str = C(customer.c.username)
+    upper_cased_username: str = C(func.upper(customer.c.username))
+    baskets: List[Basket] = Relationship(
+        customer_id == Basket.Ignore.customer_id, strategy="selectin"
+    )
+
+
+@select
+class SelectInPurchase:
+    class Ignore:
+        basket_id: int = C(purchase.c.basket_id)
+        product_id: int = C(purchase.c.product_id)
+
+    purchase_id: int = C(purchase.c.purchase_id)
+    qty: int = C(purchase.c.qty)
+    product: Product = Relationship(
+        Ignore.product_id == Product.product_id, strategy="selectin"
+    )
+
+
+@select
+class MixedBasket:
+    class Ignore:
+        customer_id: int = C(basket.c.customer_id)
+
+    basket_id: int = C(basket.c.basket_id)
+    purchases: List[SelectInPurchase] = Relationship(
+        basket_id == SelectInPurchase.Ignore.basket_id,
+        order_by=[SelectInPurchase.purchase_id],
+    )
+
+
+@select
+class MixedCustomer:
+    customer_id: int = C(customer.c.customer_id)
+    baskets: List[MixedBasket] = Relationship(
+        customer_id == MixedBasket.Ignore.customer_id,
+        order_by=[MixedBasket.basket_id],
+    )
+
+
+def test_selectin_strategy(conn):
+    insert_test_data(conn)
+    expected = unordered(list(do_select(conn, Customer)))
+    with recorded_statements(conn) as statements:
+        actual = unordered(list(do_select(conn, SelectInCustomer)))
+    assert [asdict(c) for c in actual] == [asdict(c) for c in expected]
+    assert len(statements) == 2
+    assert "basket.customer_id = ANY (" in statements[1]
+
+    filters = [Basket.basket_id == 3]
+    actual = do_select(conn, SelectInCustomer, filters, stream=True, batch_size=1)
+    actual = sorted(actual, key=lambda c: c.customer_id)
+    assert [[b.basket_id for b in c.baskets] for c in actual] == [[], [], [3]]
+
+
+def test_selectin_stream_on_fresh_session(conn, engine):
+    insert_test_data(conn)
+    expected = sorted(do_select(conn, Customer), key=lambda c: c.customer_id)
+    # outside a transaction, without any of the temporary types yet
+    engine.dispose()
+    conn.invalidate()
+    clear_registered_composites(conn)
+    actual = do_select(conn, SelectInCustomer, stream=True, batch_size=1)
+    actual = sorted(actual, key=lambda c: c.customer_id)
+    assert [asdict(c) for c in actual] == [asdict(c) for c in expected]
+
+
+def test_selectin_mixed_with_nesting(conn):
+    insert_test_data(conn)
+    [oliver, tom, harry] = do_select(
+        conn, MixedCustomer, order_by=[MixedCustomer.customer_id]
+    )
+    assert [b.basket_id for b in oliver.baskets] == [1, 2]
+    assert tom.baskets == []
+    [basket_1, _] = oliver.baskets
+    [basket_3, _] = harry.baskets
+    assert [p.product for p in basket_1.purchases] == [
+        Product(product_id=1, name="banana", price_cents=120),
+        Product(product_id=3, name="ham", price_cents=400),
+    ]
+    # each product is loaded once
+    assert basket_3.purchases[0].product is basket_1.purchases[1].product
+
+
+def test_identity_map(conn):
+    insert_test_data(conn)
+    order_by = [Customer.customer_id]
+    expected = list(do_select(conn, Customer, order_by=order_by))
+    actual = list(do_select(conn, Customer, order_by=order_by, identity_map=True))
+    assert actual == expected
+    [oliver, _, harry] = actual
+    assert harry.baskets[0].purchases[0].product.name == "ham"
+    assert harry.baskets[0].purchases[0].product is next(
+        p.product for p in oliver.baskets[0].purchases if p.product.name == "ham"
+    )
+
+    identities = {}
+    row = next(r for r in conn.execute(to_select(Customer).query) if r[0] == 1)
+    [a, b] = [from_row(Customer, row, identities) for _ in range(2)]
+    assert a == b and a is not b
+    assert a.baskets[0] is b.baskets[0]
+
+    # selectin children are shared too, across batches when streaming
+    [oliver, _, harry] = do_select(
+        conn,
+        MixedCustomer,
+        order_by=[MixedCustomer.customer_id],
+        stream=True,
+        batch_size=1,
+        identity_map=True,
+    )
+    assert harry.baskets[0].purchases[0].product is next(
+        p.product for p in oliver.baskets[0].purchases if p.product.name == "ham"
+    )
+
+
+def test_projection(conn):
+    insert_test_data(conn)
+    order_by = [Customer.customer_id]
+    expected = list(do_select(conn, Customer, order_by=order_by))
+    fields = ["customer_id", "baskets.basket_id"]
+    query = sqlformat(to_select(Customer, fields=fields).query)
+    assert "purchase" not in query and "username" not in query
+
+    [oliver, _, harry] = do_select(conn, Customer, order_by=order_by, fields=fields)
+    assert oliver.customer_id == 1
+    assert oliver.aliased_username is UNLOADED
+    assert [b.basket_id for b in oliver.baskets] == [1, 2]
+    assert oliver.baskets[0].created_date is UNLOADED
+    assert oliver.baskets[0].purchases is UNLOADED
+
+    # the fields a computed field is made of are loaded to compute it
+    fields = ["baskets.total_price_cents"]
+    actual = do_select(conn, Customer, order_by=order_by, fields=fields)
+    assert [[b.total_price_cents for b in c.baskets] for c in actual] == [
+        [b.total_price_cents for b in c.baskets] for c in expected
+    ]
+
+    # total_price_cents needs the purchases, so they're left out with it
+    exclude = ["baskets.purchases", "baskets.total_price_cents"]
+    [oliver, _, _] = do_select(conn, Customer, order_by=order_by, exclude=exclude)
+    assert oliver.baskets[0].purchases is UNLOADED
+    assert oliver.baskets[0].total_price_cents is UNLOADED
+    assert oliver.baskets[0].created_date == expected[0].baskets[0].created_date
+
+    fields = ["customer_id", "baskets.basket_id"]
+    for strategy in ["lateral", "group_by"]:
+        actual = do_select(conn, Customer, fields=fields, strategy=strategy)
+        assert sorted(len(c.baskets) for c in actual) == [0, 2, 2]
+    actual = list(do_select(conn, SelectInCustomer, fields=fields))
+    assert sorted(len(c.baskets) for c in actual) == [0, 2, 2]
+    assert all(c.upper_cased_username is UNLOADED for c in actual)
+
+    with pytest.raises(RuntimeError):
+        to_select(Customer, fields=["baskets.nope"])
+
+
+@select(slots=True, frozen=True)
+class SlimProduct:
+    product_id: int = C(product.c.product_id)
+    name: str = C(product.c.name)
+
+
+@select(slots=True, frozen=True)
+class SlimPurchase:
+    class Ignore:
+        basket_id: int = C(purchase.c.basket_id)
+        product_id: int = C(purchase.c.product_id)
+
+    purchase_id: int = C(purchase.c.purchase_id)
+    qty: int = C(purchase.c.qty)
+    product: SlimProduct = Relationship(Ignore.product_id == SlimProduct.product_id)
+
+
+@select(slots=True, frozen=True)
+class SlimBasket:
+    basket_id: int = C(basket.c.basket_id)
+    purchases: List[SlimPurchase] = Relationship(
+        basket_id == SlimPurchase.Ignore.basket_id,
+        order_by=[SlimPurchase.purchase_id],
+        strategy="selectin",
+    )
+
+
+def test_slots(conn):
+    insert_test_data(conn)
+    order_by = [SlimBasket.basket_id]
+    baskets = list(do_select(conn, SlimBasket, order_by=order_by))
+    assert [b.basket_id for b in baskets] == [1, 2, 3, 4]
+    assert [(p.qty, p.product.name) for p in baskets[2].purchases] == [
+        (4, "ham"),
+        (1, "apple"),
+    ]
+    assert not hasattr(baskets[0], "__dict__")
+    assert isinstance(SlimBasket.basket_id, C)
+    with pytest.raises(FrozenInstanceError):
+        baskets[0].basket_id = 5
+
+    assert deepcopy(baskets) == baskets
+    assert pickle.loads(pickle.dumps(baskets)) == baskets
+    [basket] = do_select(conn, SlimBasket, [SlimBasket.basket_id == 3])
+    assert basket == baskets[2]
+    basket = SlimBasket(basket_id=3, purchases=baskets[2].purchases)
+    assert basket == baskets[2]